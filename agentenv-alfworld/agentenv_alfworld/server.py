@@ -1,3 +1,4 @@
+from anyio import to_thread
 from fastapi import FastAPI
 from .env_wrapper import server
 from .model import *
@@ -10,18 +11,29 @@ def hello():
     return "This is environment AlfWorld."
 
 
+@app.get("/stats")
+async def stats():
+    """Handlers running in and waiting for the worker thread pool"""
+    limiter = to_thread.current_default_thread_limiter().statistics()
+    return {
+        "threads": limiter.total_tokens,
+        "running": limiter.borrowed_tokens,
+        "queue_depth": limiter.tasks_waiting,
+    }
+
+
 @app.post("/create")
-async def create():
+def create():
     return server.create()
 
 
 @app.post("/step")
-async def step(body: StepRequestBody):
+def step(body: StepRequestBody):
     return server.step(body.id, body.action)
 
 
 @app.post("/reset")
-async def reset(body: ResetRequestBody):
+def reset(body: ResetRequestBody):
     print("body", body)
     return server.reset(body.id, body.game, body.world_type)
 
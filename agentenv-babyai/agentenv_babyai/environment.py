@@ -10,6 +10,52 @@ import os
 from PIL import Image
 import numpy as np
 import threading
+from collections import deque
+
+
+def split_pattern(pattern):
+    """Fragments of an `obs_to_reward` pattern, separated by `**` or else by `*`"""
+    pattern = pattern.strip()
+    split_token = "**"
+    if "**" not in pattern:
+        split_token = "*"
+    return [p.strip(".") for p in pattern.split(split_token)]
+
+
+class RewardPatterns:
+    """
+    `obs_to_reward` patterns compiled once per env. A pattern is satisfied by
+    an observation when one of its sentences contains all of the pattern's
+    fragments. Patterns and fragments are interned, so `satisfied` splits the
+    observation once and tests every distinct fragment once per sentence.
+    """
+    def __init__(self, patterns):
+        self.ids = {} # pattern -> id
+        self.fragment_ids = {} # fragment -> id
+        self.required = [] # pattern id -> ids of its fragments
+        for pattern in patterns:
+            if pattern in self.ids:
+                continue
+            self.ids[pattern] = len(self.required)
+            self.required.append(frozenset(
+                self.fragment_ids.setdefault(f, len(self.fragment_ids))
+                for f in split_pattern(pattern) if f # every sentence contains ""
+            ))
+        self.fragments = list(self.fragment_ids)
+
+    def satisfied(self, obs):
+        """Ids of all patterns satisfied by `obs`"""
+        present = [
+            frozenset(i for i, f in enumerate(self.fragments) if f in sentence)
+            for sentence in obs.split(".")
+        ]
+        return {
+            pattern_id
+            for pattern_id, required in enumerate(self.required)
+            if any(required <= fragments for fragments in present)
+        }
+
+
 class BabyAI(gym.Env):
     def __init__(self, 
                  max_episode_steps=50, 
@@ -33,14 +79,18 @@ class BabyAI(gym.Env):
         self.env = gymnasium.make(game_name)
         self.render_path = render_path
         self.need_render = need_render
-        self.obs_to_reward = obs_to_reward
-        self.store_all_obs_to_reward = obs_to_reward
+        self.obs_to_reward = obs_to_reward # shared config, never modified
         self.difficulty = difficulty
-        if self.obs_to_reward is not None:
-            if isinstance(self.obs_to_reward[0], list):
+        self.reward_patterns = None
+        self.pending_rewards = None # patterns not yet rewarded in this episode
+        if self.obs_to_reward:
+            self.reward_paths = isinstance(self.obs_to_reward[0], list)
+            if self.reward_paths:
                 self.num_obs_to_reward = len(self.obs_to_reward[0])
+                self.reward_patterns = RewardPatterns(p for path in self.obs_to_reward for p in path)
             else:
                 self.num_obs_to_reward = len(self.obs_to_reward)
+                self.reward_patterns = RewardPatterns(self.obs_to_reward)
         self.reset()
         
         
@@ -83,50 +133,32 @@ class BabyAI(gym.Env):
     def _is_done(self):
         return self.done
     
-    def match_style(self, obs, pattern):
-        pattern = pattern.strip()
-        split_token = "**"
-        if "**" not in pattern:
-            split_token = "*"
-        pattern_list = pattern.strip().split(split_token)
-        all_obs = obs.split(".")
-        for obs_temp in all_obs:
-            flag = True
-            for p in pattern_list:
-                p = p.strip(".")
-                if p not in obs_temp:
-                    flag = False
-            if flag:
-                return True
-        return False
-    
     def update_reward(self, obs):
-        if self.obs_to_reward is None:
+        if not self.pending_rewards:
             return
-        if len(self.obs_to_reward) == 0:
-            return
-        if isinstance(self.obs_to_reward[0], list):
+        satisfied = self.reward_patterns.satisfied(obs)
+        if self.reward_paths:
             need_to_award = False   
-            path_length = len(self.obs_to_reward[0])
+            path_length = len(self.pending_rewards[0])
             for i in range(path_length):
-                for obs_temp in self.obs_to_reward:
-                    if self.match_style(obs, obs_temp[i]):
+                for path in self.pending_rewards:
+                    if path[i] in satisfied:
                         need_to_award = True
                         break
                 
                 if need_to_award:
                     self.points += 1
                     self.reward = max(self.reward, self.points/self.num_obs_to_reward)
-                    for obs_temp in self.obs_to_reward:
-                        obs_temp.remove(obs_temp[i])
+                    for path in self.pending_rewards:
+                        path.remove(path[i])
                     break
                 
         else:
-            for pattern in self.obs_to_reward:
-                if self.match_style(obs, pattern):
+            for pattern in self.pending_rewards:
+                if pattern in satisfied:
                     self.points += 1
                     self.reward = max(self.reward, self.points/self.num_obs_to_reward)
-                    self.obs_to_reward.remove(pattern)
+                    self.pending_rewards.remove(pattern)
                     break
                         
         
@@ -199,59 +231,104 @@ class BabyAI(gym.Env):
             
         return pos, dir
     
-    def find_path(self, init_pos, goal, all_objs, all_barriers, init_dir, xrange, yrange, arrive=False): # find the shortest path from pos to goal, all_objs is a list of position of objects, need to avoid them
-        all_things = all_objs + all_barriers
-        pos = init_pos
-        dir = init_dir
+    def find_path(self, init_pos, goal, occupancy, origin, init_dir, arrive=False): # find the shortest path from pos to goal, avoiding the blocked cells of the occupancy grid
+        """
+        BFS over (position, direction) states. `occupancy` is a boolean array of
+        blocked cells whose [0, 0] is the absolute position `origin`; cells
+        outside it cannot be entered. With `arrive` the path ends on `goal`,
+        otherwise facing it.
+        """
+        blocked = occupancy.tolist()
+        width, height = occupancy.shape
+        x0, y0 = origin
+        init_state = ((int(init_pos[0]), int(init_pos[1])), init_dir)
+        goal = (int(goal[0]), int(goal[1]))
         graph = dict()
-        queue = [(pos, dir)]
-        state = set()
-        
-        
-        while len(queue) > 0:
-            pos, dir = queue.pop(0)
-            state.add((pos, dir))
-            
-            if arrive:
-                if pos[0]==goal[0] and pos[1]==goal[1]:
-                    # get all actions that leas to current state
-                    path = []
-                    while (pos, dir) != (init_pos, init_dir):
-                        (pos, dir), action = graph[(pos, dir)]
-                        path.append(action)
-                    path = path[::-1]
-                    
-                    return path
-            else:
-                if goal[0] - pos[0] == DIR_TO_VEC[dir][0] and goal[1] - pos[1] == DIR_TO_VEC[dir][1]:
-                    path = []
-                    while (pos, dir) != (init_pos, init_dir):
-                        (pos, dir), action = graph[(pos, dir)]
-                        path.append(action)
-                    path = path[::-1]
-                    
-                    return path
-            
-            for action in [2, 0, 1]:
-                new_pos, new_dir = self.get_next_pos(pos, action, dir)
-                is_obstacle = False
-                for obj in all_things:
-                    if new_pos[0] not in xrange or new_pos[1] not in yrange:
-                        is_obstacle = True
-                        break
-                    if (new_pos, new_dir) in state:
-                        is_obstacle = True
-                        break
-                    if obj["abs_pos"] == new_pos:
-                        if "wall" in obj["name"] or "box" in obj["name"] or "lava" in obj["name"] or "ball" in obj["name"] or "key" in obj["name"]:
-                            is_obstacle = True
-                            break
-                if not is_obstacle:
-                    queue.append((new_pos, new_dir))
-                    graph[(new_pos, new_dir)] = ((pos, dir), action)
-            
+        queue = deque([init_state])
+        visited = set()
+
+        while queue:
+            state = queue.popleft()
+            visited.add(state)
+            (x, y), dir = state
+            dx, dy = DIR_TO_TUPLE[dir]
+
+            if (x, y) == goal if arrive else (goal[0] - x, goal[1] - y) == (dx, dy):
+                # get all actions that lead to current state
+                path = []
+                while state != init_state:
+                    state, action = graph[state]
+                    path.append(action)
+                return path[::-1]
+
+            # states are marked visited when expanded, so a state can be queued
+            # more than once and keeps the parent that queued it last
+            for action, new_state in (
+                (2, ((x + dx, y + dy), dir)),
+                (0, ((x, y), (dir - 1) % 4)),
+                (1, ((x, y), (dir + 1) % 4)),
+            ):
+                i, j = new_state[0][0] - x0, new_state[0][1] - y0
+                if not (0 <= i < width and 0 <= j < height):
+                    continue
+                if new_state in visited or blocked[i][j]:
+                    continue
+                queue.append(new_state)
+                graph[new_state] = (state, action)
+
         return None
 
+    def decode_view(self, grid, pos, top_left, f_vec, r_vec, dir):
+        """
+        Objects and barriers in the agent's view, in view order. Barriers are
+        the boxes and walls on the agent's line of sight, with their signed
+        distance along it.
+        """
+        view_size = grid.shape[0]
+        vis_j, vis_i = np.indices((view_size, view_size))
+        abs_i = top_left[0] - f_vec[0] * vis_j + r_vec[0] * vis_i
+        abs_j = top_left[1] - f_vec[1] * vis_j + r_vec[1] * vis_i
+        distance = np.abs(pos[0] - abs_i) + np.abs(pos[1] - abs_j)
+        cells = grid.transpose(1, 0, 2)  # indexed [vis_j, vis_i]
+        # the agent's own cell would show the carried object
+        keep = (abs_i >= 0) & (abs_j >= 0) & (distance != 0) & IS_OBJECT_OF_INTEREST[cells[..., 0]]
+
+        self_dir = DIR_TO_TUPLE[dir]
+        all_objs = []
+        all_barriers = []
+        for obj_type, obj_color, obj_state, abs_i, abs_j, dis in zip(
+            cells[..., 0][keep].tolist(),
+            cells[..., 1][keep].tolist(),
+            cells[..., 2][keep].tolist(),
+            abs_i[keep].tolist(),
+            abs_j[keep].tolist(),
+            distance[keep].tolist(),
+        ):
+            obj_type = IDX_TO_OBJECT[obj_type]
+            if obj_type == "door":
+                obj_name = IDX_TO_COLOR[obj_color] + " " + IDX_TO_STATE[obj_state] + " " + obj_type
+            else:
+                obj_name = IDX_TO_COLOR[obj_color] + " " + obj_type
+            all_objs.append({"name": obj_name, "abs_pos": (abs_i, abs_j), "dis": dis})
+
+            if obj_type in ["box", "wall"]:
+                rel_i, rel_j = abs_i - pos[0], abs_j - pos[1]
+                # check if the object is in front of or behind the agent
+                if self_dir[0] * rel_j - self_dir[1] * rel_i == 0:
+                    all_barriers.append({"name": obj_type, "abs_pos": (abs_i, abs_j), "dis": self_dir[0] * rel_i + self_dir[1] * rel_j})
+        return all_objs, all_barriers
+
+    @staticmethod
+    def occupancy_grid(all_objs, xrange, yrange):
+        """Cells of xrange x yrange blocked by an object the agent cannot walk through"""
+        occupancy = np.zeros((len(xrange), len(yrange)), dtype=bool)
+        for obj in all_objs:
+            if obj["name"].rsplit(" ", 1)[-1] in BLOCKING_OBJECTS:
+                abs_i, abs_j = obj["abs_pos"]
+                if abs_i in xrange and abs_j in yrange:
+                    occupancy[abs_i - xrange.start, abs_j - yrange.start] = True
+        return occupancy
+
     def postprocess_obs(self, obs): # postprocess the observation, translate the observation into description and possible actions
         
         _, vis_mask = self.env.unwrapped.gen_obs_grid()
@@ -282,42 +359,11 @@ class BabyAI(gym.Env):
         
         grid = obs["image"]
         dir = obs["direction"]
-        all_objs = []
         
         # identify distance to walls and barriers (box) in four directions
-        left_dis = 0
-        all_barriers = []
-        
-        for vis_j in range(0, view_size):
-            for vis_i in range(0, view_size):
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-                distance = abs(pos[0]-abs_i) + abs(pos[1]-abs_j)
-                
-                if abs_i < 0 or abs_j < 0:
-                    continue
-                
-                if distance == 0: # in case the agent counts the carrying object as an additional object
-                    continue
-                
-                obj_type = IDX_TO_OBJECT[grid[vis_i, vis_j, 0]]
-                obj_color = IDX_TO_COLOR[grid[vis_i, vis_j, 1]]
-                obj_state = IDX_TO_STATE[grid[vis_i, vis_j, 2]]
-                
-                # identify object of interest
-                if obj_type in ["door", "key", "ball", "box", "goal", "lava", "wall"]:
-                    if obj_type == "door":
-                        obj_name = obj_color + " " + obj_state + " " + obj_type
-                    else:
-                        obj_name = obj_color + " " + obj_type
-                    
-                    all_objs.append({"name": obj_name, "abs_pos":(abs_i, abs_j), "dis":distance})
-                    
-                if obj_type in ["box", "wall"]:
-                    self_dir = DIR_TO_VEC[dir] # get the direction of the agent
-                    obj_relative_pos = (abs_i - pos[0], abs_j - pos[1]) # get the relative position of the object   
-                    # check if the object is in front of the agent
-                    if np.cross(self_dir, obj_relative_pos) == 0:
-                        all_barriers.append({"name": obj_type, "abs_pos":(abs_i, abs_j), "dis":np.dot(self_dir, obj_relative_pos)})
+        all_objs, all_barriers = self.decode_view(grid, pos, top_left, f_vec, r_vec, dir)
+        occupancy = self.occupancy_grid(all_objs, xrange, yrange)
+        origin = (xrange.start, yrange.start)
                 
         # sort by distance, from near to far
         all_objs.sort(key=lambda x: x["dis"])
@@ -403,7 +449,7 @@ class BabyAI(gym.Env):
                     front_dis = np.dot(self_dir, obj_temp_relative) 
                     right_dis = np.dot(DIR_TO_VEC[(dir+1)%4], obj_temp_relative)
                 
-                    actions_temp = self.find_path(pos, obj_temp_pos, all_objs, all_barriers, dir, xrange, yrange, arrive=False) 
+                    actions_temp = self.find_path(pos, obj_temp_pos, occupancy, origin, dir, arrive=False) 
                     
                     if actions_temp is not None:
                         actions_temp.append(3) # add pickup action at the end
@@ -462,7 +508,7 @@ class BabyAI(gym.Env):
                     front_dis = np.dot(self_dir, obj_temp_relative) 
                     right_dis = np.dot(DIR_TO_VEC[(dir+1)%4], obj_temp_relative)
                     
-                    actions_temp = self.find_path(pos, obj_temp_pos, all_objs, all_barriers, dir, xrange, yrange,  arrive=True)
+                    actions_temp = self.find_path(pos, obj_temp_pos, occupancy, origin, dir,  arrive=True)
                     if actions_temp is not None:
                         possible_actions["go through "+ obj_temp["name"] + " "+ str(cnt_door[obj_temp["name"]])] = actions_temp
                     else:
@@ -478,7 +524,7 @@ class BabyAI(gym.Env):
                     front_dis = np.dot(self_dir, obj_temp_relative) 
                     right_dis = np.dot(DIR_TO_VEC[(dir+1)%4], obj_temp_relative)
                     
-                    actions_temp = self.find_path(pos, obj_temp_pos, all_objs, all_barriers, dir, xrange, yrange,  arrive=False)
+                    actions_temp = self.find_path(pos, obj_temp_pos, occupancy, origin, dir,  arrive=False)
                     
                     if actions_temp is not None:
                         possible_actions["toggle and go through " + obj_temp["name"] + " "+str(cnt_door[obj_temp["name"]])] = actions_temp + [5, 2]
@@ -507,7 +553,7 @@ class BabyAI(gym.Env):
                     front_dis = np.dot(self_dir, obj_temp_relative) 
                     right_dis = np.dot(DIR_TO_VEC[(dir+1)%4], obj_temp_relative)
                     
-                    actions_temp = self.find_path(pos, obj_temp_pos, all_objs, all_barriers, dir, xrange, yrange,  arrive=False)
+                    actions_temp = self.find_path(pos, obj_temp_pos, occupancy, origin, dir,  arrive=False)
                     
                     if actions_temp is not None:
                         possible_actions["toggle and go through " + obj_temp["name"] + " "+str(cnt_door[obj_temp["name"]])] = actions_temp + [5, 2]
@@ -532,7 +578,7 @@ class BabyAI(gym.Env):
                 front_dis = np.dot(self_dir, obj_temp_relative) 
                 right_dis = np.dot(DIR_TO_VEC[(dir+1)%4], obj_temp_relative)
                 
-                actions_temp = self.find_path(pos, obj_temp_pos, all_objs, all_barriers, dir, xrange, yrange,arrive=True)
+                actions_temp = self.find_path(pos, obj_temp_pos, occupancy, origin, dir,arrive=True)
                 if actions_temp is not None:
                     possible_actions["go to goal"] = actions_temp
                 else:
@@ -549,7 +595,7 @@ class BabyAI(gym.Env):
                 obj_name = obj_temp["name"]
                 obj_temp_pos = obj_temp["abs_pos"]
                 
-                actions_temp = self.find_path(pos, obj_temp_pos, all_objs, all_barriers, dir, xrange, yrange, arrive=False)
+                actions_temp = self.find_path(pos, obj_temp_pos, occupancy, origin, dir, arrive=False)
                 if actions_temp is not None:
                     if "go to " + obj_name + ' 1' not in possible_actions:
                         possible_actions["go to " + obj_name+ ' 1'] = actions_temp
@@ -571,10 +617,12 @@ class BabyAI(gym.Env):
         
     def reset(self):
         obs, infos = self.env.reset(seed=self.seed)
-        if self.store_all_obs_to_reward is not None:
-            self.obs_to_reward = self.store_all_obs_to_reward.copy()
+        if self.reward_patterns is None:
+            self.pending_rewards = None
+        elif self.reward_paths:
+            self.pending_rewards = [[self.reward_patterns.ids[p] for p in path] for path in self.obs_to_reward]
         else:
-            self.obs_to_reward = None
+            self.pending_rewards = [self.reward_patterns.ids[p] for p in self.obs_to_reward]
         self.goal = self.env.unwrapped.mission 
         if "then" in self.goal: 
             self.goal = self.goal.replace("then", "and")
@@ -795,6 +843,13 @@ DIR_TO_VEC = [
     np.array((0, -1)),
 ]
 
+DIR_TO_TUPLE = [tuple(int(v) for v in vec) for vec in DIR_TO_VEC]
+
+# objects described to the agent, and those it cannot walk through
+IS_OBJECT_OF_INTEREST = np.zeros(256, dtype=bool)
+IS_OBJECT_OF_INTEREST[[OBJECT_TO_IDX[t] for t in ["door", "key", "ball", "box", "goal", "lava", "wall"]]] = True
+BLOCKING_OBJECTS = {"wall", "box", "lava", "ball", "key"}
+
 class BabyAIEnv:
     def __init__(self):
         self._max_id = 0
@@ -23,7 +23,7 @@ def hello():
 
 
 @app.post("/create")
-async def create():
+def create():
     return server.create()
 
 
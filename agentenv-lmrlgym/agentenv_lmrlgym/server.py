@@ -18,7 +18,7 @@ def hello():
 
 
 @app.post("/maze/create")
-async def maze_create():
+def maze_create():
     return maze_server.create()
 
 
@@ -53,7 +53,7 @@ def maze_get_detailed_info(id: int):
 
 
 @app.post("/wordle/create")
-async def wordle_create():
+def wordle_create():
     return wordle_server.create()
 
 
@@ -4,6 +4,7 @@ SqlGymEnvServer
 
 import os
 import random
+import threading
 import time
 from typing import Literal, Mapping, Optional, Tuple
 
@@ -34,20 +35,22 @@ class SqlGymEnvServer:
         self.ls = []
         self.sz = 8
         self.now = -1
+        self._lock = threading.Lock()
 
     def create(self) -> int:
-        random.seed(time.time())
-        idx = random.randint(0, 489576)
-        print(f"-------Env {idx} created--------")
-        if len(self.env) == self.sz:
-            self.now = self.now + 1
-            if self.now == self.sz:
-                self.now = 0
-            return self.ls[self.now]
-
-        self.env[idx] = (None, "not_initialized")
-        self.ls.append(idx)
-        return idx
+        with self._lock:
+            random.seed(time.time())
+            idx = random.randint(0, 489576)
+            print(f"-------Env {idx} created--------")
+            if len(self.env) == self.sz:
+                self.now = self.now + 1
+                if self.now == self.sz:
+                    self.now = 0
+                return self.ls[self.now]
+
+            self.env[idx] = (None, "not_initialized")
+            self.ls.append(idx)
+            return idx
 
     def observation(self, env_idx):
         self._check_env_idx(env_idx)
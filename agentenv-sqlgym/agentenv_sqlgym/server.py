@@ -2,8 +2,12 @@
 FastAPI Server
 """
 
+import asyncio
 import logging
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Literal, Tuple
 
 from fastapi import FastAPI, Request
@@ -15,6 +19,31 @@ from .utils import debug_flg
 app = FastAPI(debug=debug_flg)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
 
+# SQLite releases the GIL while it executes a query, so env work runs in
+# threads. A connection may only be used by the thread that opened it, so
+# every env is pinned to one single-threaded shard, chosen by its id.
+NUM_SHARDS = int(os.environ.get("AGENTENV_SQLGYM_THREADS", os.cpu_count() or 1))
+_shards = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlgym-shard{i}")
+    for i in range(NUM_SHARDS)
+]
+_queue_depth = [0] * NUM_SHARDS
+_queue_lock = threading.Lock()
+
+
+async def run_in_shard(env_idx: int, fn, *args):
+    """Run `fn(*args)` on the shard that owns env `env_idx`"""
+    shard = env_idx % NUM_SHARDS
+    with _queue_lock:
+        _queue_depth[shard] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            _shards[shard], fn, *args
+        )
+    finally:
+        with _queue_lock:
+            _queue_depth[shard] -= 1
+
 
 # 自定义中间件
 @app.middleware("http")
@@ -40,8 +69,16 @@ async def list_envs():
     return list(sqlgym_env_server.env.keys())
 
 
+@app.get("/stats")
+async def stats():
+    """Requests queued or running on each shard"""
+    with _queue_lock:
+        queue_depth = list(_queue_depth)
+    return {"num_shards": NUM_SHARDS, "queue_depth": queue_depth}
+
+
 @app.post("/create", response_model=int)
-async def create():
+def create():
     """Create a new environment"""
     env = sqlgym_env_server.create()
 
@@ -53,8 +90,11 @@ async def step(step_query: StepQuery):
     print("/step")
     print(step_query.env_idx)
     print(step_query.action)
-    state, reward, done, info = sqlgym_env_server.step(
-        step_query.env_idx, step_query.action
+    state, reward, done, info = await run_in_shard(
+        step_query.env_idx,
+        sqlgym_env_server.step,
+        step_query.env_idx,
+        step_query.action,
     )
     print(step_query.env_idx)
     print(state)
@@ -65,11 +105,17 @@ async def step(step_query: StepQuery):
 async def observation(env_idx: int):
     print("/observation")
     print(env_idx)
-    res = sqlgym_env_server.observation(env_idx)
+    res = await run_in_shard(env_idx, sqlgym_env_server.observation, env_idx)
     return res
 
 
 @app.post("/reset", response_model=Tuple[str, None])
 async def reset(reset_query: ResetQuery):
     print(reset_query)
-    return sqlgym_env_server.reset(reset_query.env_idx, reset_query.item_id), None
+    res = await run_in_shard(
+        reset_query.env_idx,
+        sqlgym_env_server.reset,
+        reset_query.env_idx,
+        reset_query.item_id,
+    )
+    return res, None
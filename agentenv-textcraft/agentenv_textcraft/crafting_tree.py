@@ -1,7 +1,9 @@
-from copy import deepcopy
+import hashlib
+import itertools
 import json
 from math import ceil
 import os
+import pickle
 import random
 from unittest import skip
 from typing import List, Set, Dict
@@ -11,9 +13,22 @@ from numpy import rec
 from .utils import ItemTag, ItemTagWithCount, Recipe, ActionFailed, item_id_to_str
 
 
-class CraftingTree:
+CACHE_VERSION = 2
+
 
-    def __init__(self, minecraft_dir):
+class CraftingTree:
+    """
+    Recipe graph of TextCraft.
+
+    Everything `TextCraftEnv.reset` needs (the sorted goal list, the item use
+    index, tag -> items and the recipe closure of every goal) is computed once
+    at load, as is the craft index of every item's recipes by ingredient
+    signature. After that the tree is read-only and can be shared by envs in
+    several threads. With `cache_path`, the loaded tree is pickled there and
+    reused as long as the recipe files are unchanged.
+    """
+
+    def __init__(self, minecraft_dir, cache_path=None):
         self.tag_recipes = {}  # recipes for tags (i.e. item types)
         self.itemid_recipes: Dict[str, list[Recipe]] = {}  # recipes for items
         self.tag_set = set()  # set of tags
@@ -24,8 +39,68 @@ class CraftingTree:
         self.transitive_dependencies = {}
         # minimum depth of recipe tree to craft an item
         self.min_depth = {}
+        if cache_path is not None and self._load_cache(cache_path, minecraft_dir):
+            return
         self._load_recipes(minecraft_dir)
+        self.tag_items = self._index_tag_items()
         self.clean_up_recipes()
+        self._build_indexes()
+        if cache_path is not None:
+            self._save_cache(cache_path, minecraft_dir)
+
+    def _index_tag_items(self):
+        tag_items = {}
+        for item_id, tag in self.item_id_to_tag.items():
+            tag_items.setdefault(tag, []).append(item_id)
+        return tag_items
+
+    def _build_indexes(self):
+        # item -> {signature: (recipe index, output)}, keeping the first recipe
+        # of a signature like the recipe scan it replaces
+        self.craft_index = {}
+        for item_id, recipes in self.itemid_recipes.items():
+            signatures = self.craft_index[item_id] = {}
+            for i, recipe in enumerate(recipes):
+                signature = tuple(
+                    sorted(self._ingredient_key(item) for item in recipe.input_items)
+                )
+                signatures.setdefault(signature, (i, recipe.output_item))
+        self.item_uses = self.collect_item_uses()
+        # goals of depth >= 1 by depth; `data_idx` selects from this list
+        self.goal_items = sorted(self.item_recipes_min_depth(1), key=lambda x: x[1])
+        self.recipe_closures = {
+            item: tuple(self.traverse_recipe_tree(item, set()))
+            for item, _ in self.goal_items
+        }
+
+    @staticmethod
+    def _recipes_key(minecraft_dir):
+        recipes_dir = os.path.join(minecraft_dir, "recipes/")
+        key = hashlib.sha256(str(CACHE_VERSION).encode())
+        for f in sorted(os.listdir(recipes_dir)):
+            stat = os.stat(os.path.join(recipes_dir, f))
+            key.update(f"{f}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return key.hexdigest()
+
+    def _load_cache(self, cache_path, minecraft_dir):
+        if not os.path.exists(cache_path):
+            return False
+        with open(cache_path, "rb") as f:
+            key, state = pickle.load(f)
+        if key != self._recipes_key(minecraft_dir):
+            return False
+        self.__dict__.update(state)
+        return True
+
+    def _save_cache(self, cache_path, minecraft_dir):
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                (self._recipes_key(minecraft_dir), self.__dict__),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, cache_path)
 
     def clean_up_recipes(self):
         # make sure every recipe with input tag has craftable recipes or items
@@ -175,53 +250,36 @@ class CraftingTree:
                         else:
                             self.tag_recipes[recipe_tag].append(recipe)
 
+    @staticmethod
+    def _ingredient_key(itemtag_count: ItemTagWithCount):
+        item_tag = itemtag_count.item_tag
+        if item_tag.item_id is not None:
+            return ("item", item_tag.item_id, itemtag_count.count)
+        return ("tag", item_tag.tag, itemtag_count.count)
+
+    def _input_keys(self, itemtag_count: ItemTagWithCount):
+        """Ingredient keys an input item can fill: its id, its tag or the tag of its id"""
+        item_tag = itemtag_count.item_tag
+        keys = []
+        if item_tag.item_id is not None:
+            keys.append(("item", item_tag.item_id, itemtag_count.count))
+        for tag in dict.fromkeys(
+            (item_tag.tag, self.item_id_to_tag.get(item_tag.item_id))
+        ):
+            if tag is not None:
+                keys.append(("tag", tag, itemtag_count.count))
+        return keys
+
     def craft(self, recipe: Recipe) -> ItemTagWithCount:
-        if recipe.output_item.item_tag.item_id not in self.itemid_recipes:
+        signatures = self.craft_index.get(recipe.output_item.item_tag.item_id)
+        if signatures is None:
             return None
-        target_recipes = self.itemid_recipes[recipe.output_item.item_tag.item_id]
-        for target_recipe in target_recipes:
-            success = True
-            # check that input recipe items matches the target recipe items
-            input_recipe_items_clone = deepcopy(recipe.input_items)
-            for itemtag_count in target_recipe.input_items:
-                itemtag = itemtag_count.item_tag
-                input_itemtag_count = self.find_matching_item(
-                    itemtag, input_recipe_items_clone
-                )
-                if input_itemtag_count is None:
-                    success = False
-                    break
-
-                if input_itemtag_count.count != itemtag_count.count:
-                    print("Wrong Item Count for: {}".format(input_itemtag_count))
-                    success = False
-                    break
-
-                input_recipe_items_clone.remove(input_itemtag_count)
-
-            if len(input_recipe_items_clone):
-                success = False
-
-            if success:
-                return target_recipe.output_item
-
-        return None
-
-    def find_matching_item(
-        self, itemtag: ItemTag, input_recipe_items: List[ItemTagWithCount]
-    ):
-        for input_itemtag_count in input_recipe_items:
-            if itemtag.item_id is not None:
-                if input_itemtag_count.item_tag.item_id == itemtag.item_id:
-                    return input_itemtag_count
-            elif itemtag.tag is not None:
-                if (
-                    input_itemtag_count.item_tag.tag == itemtag.tag
-                    or self.item_id_to_tag.get(input_itemtag_count.item_tag.item_id)
-                    == itemtag.tag
-                ):
-                    return input_itemtag_count
-        return None
+        match = None
+        for keys in itertools.product(*map(self._input_keys, recipe.input_items)):
+            candidate = signatures.get(tuple(sorted(keys)))
+            if candidate is not None and (match is None or candidate[0] < match[0]):
+                match = candidate
+        return None if match is None else match[1]
 
     def is_craftable(self, item: str):
         return item in self.itemid_recipes or item in self.tag_recipes
@@ -233,9 +291,7 @@ class CraftingTree:
         return input in self.tag_set
 
     def get_items_with_tags(self, input_tag: str):
-        for item_id, tag in self.item_id_to_tag.items():
-            if input_tag == tag:
-                yield item_id
+        yield from self.tag_items.get(input_tag, ())
 
     def print_all_recipes(self):
         for item, recipes in self.itemid_recipes.items():
@@ -338,8 +394,11 @@ class CraftingTree:
                 yield item
 
     def create_recipe_set(self, item_name: str):
-        item_uses = self.collect_item_uses()
-        recipes = self.traverse_recipe_tree(item_name, set())
+        item_uses = self.item_uses
+        if item_name in self.recipe_closures:
+            recipes = list(self.recipe_closures[item_name])
+        else:
+            recipes = self.traverse_recipe_tree(item_name, set())
         distractors = []
         for recipe in recipes:
             for item in recipe.input_items:
@@ -1,5 +1,6 @@
 from .environment import TextCraftEnv
 from .crafting_tree import CraftingTree
+import os
 import threading
 
 class TextCraft_Wrapper:
@@ -8,7 +9,10 @@ class TextCraft_Wrapper:
         self.env = {}  # dict[id, env_item]
         self.info = {}  # dict[id, env_info]
         self.ls = []
-        self.crafting_tree = CraftingTree(minecraft_dir=minecraft_dir)
+        self.crafting_tree = CraftingTree(
+            minecraft_dir=minecraft_dir,
+            cache_path=os.environ.get("AGENTENV_TEXTCRAFT_TREE_CACHE"),
+        )
         self._lock = threading.Lock()
 
     def create(self, commands: str = None, goal: str = None):
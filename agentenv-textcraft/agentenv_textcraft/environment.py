@@ -163,10 +163,9 @@ class TextCraftEnv(gym.Env[str, str]):
                 {},
             )
         random.seed(seed)
-        item_depth_list = list(self.crafting_tree.item_recipes_min_depth(1))
         # use idx to deterministically select goal
-        sorted_item_depth_list = sorted(item_depth_list, key=lambda x: x[1])
-        goal_depth = sorted_item_depth_list[data_idx % len(item_depth_list)]
+        goal_items = self.crafting_tree.goal_items
+        goal_depth = goal_items[data_idx % len(goal_items)]
         # example: self.goal = "minecraft:dark_oak_sign"
         self.goal = goal_depth[0]
         recipes_set = set()
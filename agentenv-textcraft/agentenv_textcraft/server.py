@@ -23,7 +23,7 @@ def hello():
 
 
 @app.post("/create")
-async def create(body: CreateRequestBody):
+def create(body: CreateRequestBody):
     return server.create(body.commands, body.goal)
 
 
@@ -15,8 +15,20 @@ def launch():
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=8000)
     parser.add_argument("--host", type=str, default="0.0.0.0")
-    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="envs live in one process; to use more, run several workers behind "
+        "`python -m agentenv.controller.env_router`",
+    )
     args = parser.parse_args()
+    if args.workers > 1:
+        # every worker would own only the envs it created itself
+        parser.error(
+            "envs live in one process, so --workers must be 1; to use more, "
+            "run several workers behind `python -m agentenv.controller.env_router`"
+        )
     uvicorn.run(
         "agentenv_sheet:app",
         host=args.host,
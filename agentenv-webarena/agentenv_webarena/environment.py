@@ -3,8 +3,11 @@ WebarenaEnvServer
 """
 
 import json
+import os
 import pickle
+import queue
 import re
+import threading
 from pathlib import Path
 import time
 from typing import Any, Optional
@@ -20,13 +23,17 @@ from browser_env import (
 )
 from browser_env.actions import ActionParsingError
 from browser_env.env_config import URL_MAPPINGS
+from browser_env.envs import SETTLE_POLL_INTERVAL
 from browser_env.helper_functions import RenderHelper, get_action_description
 from browser_env.utils import Observation
 from evaluation_harness import evaluator_router
 
 
 from multiprocessing.connection import Connection
-from typing import Any, TypedDict
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Generator, TypedDict
+
+import numpy as np
 
 from browser_env import (
     Action,
@@ -36,34 +43,159 @@ from browser_env import (
     create_stop_action,
 )
 from evaluation_harness import evaluator_router
+from playwright.sync_api import Browser, sync_playwright
 import asyncio
 
+# browser processes shared by all envs, each hosting the browser contexts of
+# several envs; 0 starts one browser process per env
+NUM_BROWSERS = int(os.environ.get("AGENTENV_WEBARENA_BROWSERS", 0))
+# size of each env's shared screenshot buffer, an RGBA viewport screenshot
+IMAGE_BUFFER_SIZE = 1280 * 720 * 4
+
 # ===== commands =====
 class WASubprocessCommand(TypedDict, total=False):
     cmd: str
     data: Any
 
 
+class SharedImage(TypedDict):
+    """An image observation written to the env's shared image buffer"""
+
+    shape: tuple[int, ...]
+    dtype: str
+
+
+class StateRef(TypedDict):
+    """The `state_ref`-th state of the episode, kept in the subprocess"""
+
+    state_ref: int
+
+
 # ===== state =====
 
 
-def wa_entrypoint(pipe: Connection):
-    """Main entrypoint for the subprocess.
+def put_shared_image(
+    obs: dict[str, Observation], image_buffer: SharedMemory | None
+) -> dict[str, Any]:
+    """Move the image of `obs` to `image_buffer`, if it fits, to send it without pickling"""
+    image = obs.get("image")
+    if (
+        image_buffer is None
+        or not isinstance(image, np.ndarray)
+        or image.nbytes > image_buffer.size
+    ):
+        return obs
+    shared = np.ndarray(image.shape, dtype=image.dtype, buffer=image_buffer.buf)
+    shared[...] = image
+    return {**obs, "image": SharedImage(shape=image.shape, dtype=image.dtype.str)}
 
-    Creates the environment and listens for commands from the pipe until a STOP command is received.
 
-    POSTCONDITION: Every received command will send back exactly one response.
-    RESTRICTION: No commands will be sent in parallel.
+def get_shared_image(
+    obs: dict[str, Any], image_buffer: SharedMemory | None
+) -> dict[str, Observation]:
     """
-    env_config_file = None
-    wa_env = ScriptBrowserEnv(
+    Inverse of `put_shared_image`. The image is copied out of `image_buffer`,
+    which the next reset or step of the env overwrites.
+    """
+    image = obs.get("image")
+    if image_buffer is None or not isinstance(image, dict):
+        return obs
+    return {
+        **obs,
+        "image": np.ndarray(
+            image["shape"], dtype=np.dtype(image["dtype"]), buffer=image_buffer.buf
+        ).copy(),
+    }
+
+
+def without_image(obs: dict[str, Any]) -> dict[str, Any]:
+    """`obs` without its image, which the server never reads"""
+    return {key: value for key, value in obs.items() if key != "image"}
+
+
+def make_wa_env(browser: Browser | None = None) -> ScriptBrowserEnv:
+    return ScriptBrowserEnv(
         headless=True,
         slow_mo=0,
         observation_type="accessibility_tree",
         current_viewport_only=True,
         viewport_size={"width": 1280, "height": 720},
         sleep_after_execution=1.5,
+        settle_mode="adaptive",
+        settle_timeout=5.0,
+        browser=browser,
     )
+
+
+def run_wa_command(
+    wa_env: ScriptBrowserEnv, state: dict[str, Any], data: WASubprocessCommand
+) -> Any:
+    """
+    Run an env command in the subprocess. `state` keeps the env's config file,
+    its shared image buffer and the states of the current episode, which
+    "eval" trajectories refer to with `StateRef`s.
+    """
+    return wa_env.run_settling(wa_command_settling(wa_env, state, data))
+
+
+def wa_command_settling(
+    wa_env: ScriptBrowserEnv, state: dict[str, Any], data: WASubprocessCommand
+) -> Generator[None, None, Any]:
+    """Like `run_wa_command`, but yield while the page settles"""
+    image_buffer = state.get("image_buffer")
+    match data:
+        case {"cmd": "reset", "data": {"seed": seed, "options": options, "config_file": config_file}}:
+            state["config_file"] = config_file
+            obs, info = yield from wa_env.reset_settling(seed=seed, options=options)
+            state["states"] = [StateInfo(observation=obs, info=info)]
+            return put_shared_image(obs, image_buffer), info
+        case {"cmd": "step", "data": {"action": action}}:
+            obs, reward, terminated, truncated, info = yield from wa_env.step_settling(
+                action
+            )
+            state["states"].append(StateInfo(observation=obs, info=info))
+            obs = put_shared_image(obs, image_buffer)
+            return obs, reward, terminated, truncated, info
+        case {"cmd": "page"}:
+            return wa_env.page
+        case {"cmd": "get_page_client", "data": {"page": page}}:
+            return wa_env.get_page_client(page)
+        case {"cmd": "_get_obs_metadata"}:
+            return wa_env._get_obs_metadata()
+        case {"cmd": "eval", "data": {"trajectory": trajectory}}:
+            trajectory = [
+                state["states"][item["state_ref"]] if "state_ref" in item else item
+                for item in trajectory
+            ]
+            env_config_file = state.get("config_file")
+            if env_config_file:
+                evaluator = evaluator_router(env_config_file)
+                print(env_config_file)
+                return evaluator(
+                    trajectory=trajectory,
+                    config_file=env_config_file,
+                    page=wa_env.page,
+                    client=wa_env.get_page_client(wa_env.page),
+                )
+            return 0.0
+        case other:
+            print(f"!!! UNKNOWN COMMAND IN WA IPC !!!\n{other}")
+            raise ValueError("Unknown command")
+
+
+def wa_entrypoint(pipe: Connection, image_buffer_name: str | None = None):
+    """Main entrypoint for the subprocess.
+
+    Creates the environment and listens for commands from the pipe until a STOP command is received.
+    Image observations are passed through the shared memory `image_buffer_name`.
+
+    POSTCONDITION: Every received command will send back exactly one response.
+    RESTRICTION: No commands will be sent in parallel.
+    """
+    state = {}
+    if image_buffer_name is not None:
+        state["image_buffer"] = SharedMemory(name=image_buffer_name)
+    wa_env = make_wa_env()
     running = True
 
     while running:
@@ -77,34 +209,8 @@ def wa_entrypoint(pipe: Connection):
                 case {"cmd": "close"}:
                     running = False
                     # retval = wa_env.close()
-                # case {"cmd": "reset"}:
-                #     retval = wa_env.reset()
-                case {"cmd": "reset", "data": {"seed": seed, "options": options, "config_file": config_file}}:
-                    env_config_file = config_file
-                    retval = wa_env.reset(seed=seed, options=options)
-                case {"cmd": "step", "data": {"action": action}}:
-                    retval = wa_env.step(action)
-                case {"cmd": "page"}:
-                    retval = wa_env.page
-                case {"cmd": "get_page_client", "data": {"page": page}}:
-                    retval = wa_env.get_page_client(page)
-                case {"cmd": "_get_obs_metadata"}:
-                    retval = wa_env._get_obs_metadata()
-                case {"cmd": "eval", "data": {"trajectory": trajectory}}:
-                    if env_config_file:
-                        evaluator = evaluator_router(env_config_file)
-                        print(env_config_file)
-                        retval = evaluator(
-                        trajectory=trajectory,
-                        config_file=env_config_file,
-                        page=wa_env.page,
-                        client=wa_env.get_page_client(wa_env.page),
-                        )
-                    else:
-                        retval = 0.0
-                case other:
-                    print(f"!!! UNKNOWN COMMAND IN WA IPC !!!\n{other}")
-                    raise ValueError("Unknown command")
+                case _:
+                    retval = run_wa_command(wa_env, state, data)
         except Exception as e:
             retval = e
 
@@ -113,6 +219,95 @@ def wa_entrypoint(pipe: Connection):
 
     # clean up
     wa_env.close()
+    if image_buffer_name is not None:
+        state["image_buffer"].close()
+
+
+def wa_pool_entrypoint(pipe: Connection):
+    """Entrypoint of a browser subprocess shared by several envs.
+
+    Launches one Chromium and gives every env opened on it its own browser
+    context, which is replaced on each reset. One Playwright connection
+    drives all of them: while the page of an env settles after an action,
+    the commands of the other envs run. Commands carry the id of their env
+    in "env" and so do their responses; "open" and "close" add and remove an
+    env, and "shutdown" stops the subprocess. "open" may name a shared image
+    buffer for the env.
+
+    POSTCONDITION: Every received command will send back exactly one response.
+    RESTRICTION: No commands will be sent in parallel for the same env.
+    """
+    wa_envs: dict[int, ScriptBrowserEnv] = {}
+    states: dict[int, dict[str, Any]] = {}
+    # env id -> its command, waiting for the page of the env to settle
+    settling: dict[int, Generator[None, None, Any]] = {}
+
+    def advance(env_idx: int, command: Generator[None, None, Any]) -> None:
+        """Run `command` until it waits for its page, respond once it is done"""
+        try:
+            next(command)
+        except StopIteration as e:
+            retval = e.value
+        except Exception as e:
+            retval = e
+        else:
+            settling[env_idx] = command
+            return
+        settling.pop(env_idx, None)
+        pipe.send({"env": env_idx, "retval": retval})
+
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch(headless=True, slow_mo=0)
+        running = True
+        while running:
+            if settling and not pipe.poll():
+                # delivers the events of every page of the browser meanwhile
+                wa_envs[next(iter(settling))].pause(SETTLE_POLL_INTERVAL)
+                for env_idx, command in list(settling.items()):
+                    advance(env_idx, command)
+                continue
+
+            retval = None
+            data: WASubprocessCommand = pipe.recv()
+            env_idx = data.get("env")
+            try:
+                match data:
+                    case {"cmd": "shutdown"}:
+                        running = False
+                    case {"cmd": "open"}:
+                        wa_envs[env_idx] = make_wa_env(browser)
+                        states[env_idx] = {}
+                        image_buffer_name = data.get("data", {}).get("image_buffer")
+                        if image_buffer_name is not None:
+                            states[env_idx]["image_buffer"] = SharedMemory(
+                                name=image_buffer_name
+                            )
+                    case {"cmd": "close"}:
+                        state = states.pop(env_idx)
+                        if "image_buffer" in state:
+                            state["image_buffer"].close()
+                        wa_envs.pop(env_idx).close()
+                    case _ if env_idx in wa_envs:
+                        advance(
+                            env_idx,
+                            wa_command_settling(wa_envs[env_idx], states[env_idx], data),
+                        )
+                        continue
+                    case other:
+                        print(f"!!! UNKNOWN COMMAND IN WA IPC !!!\n{other}")
+                        raise ValueError("Unknown command")
+            except Exception as e:
+                retval = e
+            pipe.send({"env": env_idx, "retval": retval})
+
+        for command in settling.values():
+            command.close()
+        for wa_env in wa_envs.values():
+            wa_env.close()
+        for state in states.values():
+            if "image_buffer" in state:
+                state["image_buffer"].close()
+        browser.close()
 
 
 import multiprocessing
@@ -197,12 +392,75 @@ class PromptConstructor:
         return response
 
 
+class WABrowserWorker:
+    """
+    A browser subprocess running `wa_pool_entrypoint`, leased to several envs.
+    Its envs share one pipe; responses are matched to the waiting env by id,
+    so a slow env does not hold up the others.
+    """
+
+    def __init__(self) -> None:
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=wa_pool_entrypoint, args=(child_conn,)
+        )
+        self.process.start()
+        self.env_ids = set()
+        self.lock = threading.Lock()
+        # env id, or None for the worker itself -> queue of its response
+        self.pending: dict[int | None, queue.Queue] = {}
+        self.reader = threading.Thread(target=self._read_responses, daemon=True)
+        self.reader.start()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def _read_responses(self) -> None:
+        while True:
+            try:
+                response = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                pending = self.pending.pop(response["env"], None)
+            if pending is not None:
+                pending.put(response["retval"])
+        # fail the commands that will never be answered
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for waiting in pending.values():
+            waiting.put(RuntimeError("Browser worker exited"))
+
+    def send(self, msg: WASubprocessCommand) -> Any:
+        response = queue.Queue(maxsize=1)
+        with self.lock:
+            if not self.reader.is_alive():
+                raise RuntimeError("Browser worker exited")
+            self.pending[msg.get("env")] = response
+            self.conn.send(msg)
+        return response.get()
+
+    def shutdown(self) -> None:
+        if self.is_alive():
+            try:
+                self.send({"cmd": "shutdown"})
+            except Exception as e:
+                print(f"Browser worker shutdown error: {e}")
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.kill()
+        self.conn.close()
+
+
 class WebarenaEnvServer:
     """
     WebarenaEnvServer
+
+    With `num_browsers` > 0, envs are leased from a pool of that many browser
+    subprocesses instead of each starting its own, see `WABrowserWorker`.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, num_browsers: int = NUM_BROWSERS) -> None:
         self._max_id = 0
         self.envs = {}
         self.state_info = {}  # env_idx -> {"observation": obs, "info": info}
@@ -214,6 +472,40 @@ class WebarenaEnvServer:
         )
         self.wa_send = {}
         self.wa_recv = {}
+        self.num_browsers = num_browsers
+        self.browser_workers: list[WABrowserWorker] = []
+        self._lease_lock = threading.Lock()
+        # env_idx -> shared memory the subprocess writes image observations to
+        self.image_buffers: dict[int, SharedMemory] = {}
+
+    def lease_browser(self, env_idx: int) -> WABrowserWorker:
+        """Pick the browser worker with the fewest envs, starting it if needed"""
+        with self._lease_lock:
+            # replace browser workers that died, their envs are lost
+            for i, worker in enumerate(self.browser_workers):
+                if not worker.is_alive():
+                    print(f"Browser worker {i} is dead, restarting")
+                    worker.shutdown()
+                    self.browser_workers[i] = WABrowserWorker()
+            if len(self.browser_workers) < self.num_browsers:
+                self.browser_workers.append(WABrowserWorker())
+            worker = min(self.browser_workers, key=lambda w: len(w.env_ids))
+            worker.env_ids.add(env_idx)
+            return worker
+
+    def release_browser(self, env_idx: int) -> None:
+        with self._lease_lock:
+            self.envs[env_idx].env_ids.discard(env_idx)
+
+    def release_image_buffer(self, env_idx: int) -> None:
+        image_buffer = self.image_buffers.pop(env_idx, None)
+        if image_buffer is not None:
+            try:
+                image_buffer.close()
+            except BufferError as e:
+                print(f"Error while closing image buffer of env {env_idx}: {e}")
+            finally:
+                image_buffer.unlink()
 
     def send_command(self, idx: int, cmd: str, **data):
         """Send a command and retrieve its response."""
@@ -222,8 +514,11 @@ class WebarenaEnvServer:
             raise RuntimeError(f"Error: Env {idx} is dead")
         msg = {"cmd": cmd, "data": data}
         try:
-            self.wa_send[idx].send(msg)
-            retval = self.wa_send[idx].recv()
+            if self.num_browsers > 0:
+                retval = self.envs[idx].send({**msg, "env": idx})
+            else:
+                self.wa_send[idx].send(msg)
+                retval = self.wa_send[idx].recv()
             if isinstance(retval, Exception):
                 raise retval
         except Exception as e:
@@ -236,13 +531,26 @@ class WebarenaEnvServer:
         Only call this create function once.
         """
         print(f"Creating env {env_idx}")
-        (self.wa_send[env_idx], self.wa_recv[env_idx]) = (
-            multiprocessing.Pipe()
-        )
-        self.envs[env_idx] = multiprocessing.Process(
-            target=wa_entrypoint, args=(self.wa_recv[env_idx],)
-        )
-        self.envs[env_idx].start()
+        image_buffer = SharedMemory(create=True, size=IMAGE_BUFFER_SIZE)
+        self.image_buffers[env_idx] = image_buffer
+        if self.num_browsers > 0:
+            self.envs[env_idx] = self.lease_browser(env_idx)
+            retval = self.envs[env_idx].send(
+                {"cmd": "open", "env": env_idx, "data": {"image_buffer": image_buffer.name}}
+            )
+            if isinstance(retval, Exception):
+                self.release_browser(env_idx)
+                del self.envs[env_idx]
+                self.release_image_buffer(env_idx)
+                raise retval
+        else:
+            (self.wa_send[env_idx], self.wa_recv[env_idx]) = (
+                multiprocessing.Pipe()
+            )
+            self.envs[env_idx] = multiprocessing.Process(
+                target=wa_entrypoint, args=(self.wa_recv[env_idx], image_buffer.name)
+            )
+            self.envs[env_idx].start()
 
         # self.envs[self._max_id] = ScriptBrowserEnv(
         #     headless=True,
@@ -305,9 +613,12 @@ class WebarenaEnvServer:
             obs, reward, terminated, truncated, info = self.send_command(
                 env_idx, "step", action=action
             )
-            
-
-            self.state_info[env_idx] = {"observation": obs, "info": info}
+            # the evaluation reads the states kept by the subprocess, so the
+            # image is left in the buffer
+            self.state_info[env_idx] = {
+                "observation": without_image(obs),
+                "info": info,
+            }
             self.trajectory[env_idx].append(self.state_info[env_idx])
 
             prompt = self.prompt_constructor.construct(
@@ -335,10 +646,20 @@ class WebarenaEnvServer:
                 #     page=page,
                 #     client=self.send_command(env_idx, "get_page_client", page=page),
                 # )
+                # the subprocess keeps the states of the episode, send
+                # references to them instead of the observations
+                trajectory = []
+                num_states = 0
+                for item in self.trajectory[env_idx]:
+                    if "observation" in item:
+                        trajectory.append(StateRef(state_ref=num_states))
+                        num_states += 1
+                    else:
+                        trajectory.append(item)
                 reward = self.send_command(
                     env_idx,
                     "eval",
-                    trajectory=self.trajectory[env_idx],
+                    trajectory=trajectory,
                 )
                 
 
@@ -405,9 +726,10 @@ class WebarenaEnvServer:
             obs, info = self.send_command(env_idx, "reset", seed=seed, options=options, config_file=self.config_file)
         except Exception as e:
             raise e
+        obs = get_shared_image(obs, self.image_buffers[env_idx])
 
         self.trajectory[env_idx] = []
-        self.state_info[env_idx] = {"observation": obs, "info": info}
+        self.state_info[env_idx] = {"observation": without_image(obs), "info": info}
         self.trajectory[env_idx].append(self.state_info[env_idx])
 
         self.meta_data[env_idx] = {"action_history": ["None"]}
@@ -415,7 +737,16 @@ class WebarenaEnvServer:
         return (obs, info, _c["sites"], _c["intent"])
 
     def close(self, env_idx) -> None:
-        if env_idx in self.envs:
+        if env_idx in self.envs and self.num_browsers > 0:
+            try:
+                # close the env's browser context, the browser stays up
+                self.send_command(env_idx, "close")
+            except Exception as e:
+                print(f"Error while closing environment {env_idx}: {e}")
+            self.release_browser(env_idx)
+            del self.envs[env_idx]
+            print(f"Environment {env_idx} closed successfully.")
+        elif env_idx in self.envs:
             try:
                 # Send close command to subprocess\
                 self.send_command(env_idx, "close")
@@ -446,14 +777,14 @@ class WebarenaEnvServer:
                 del self.envs[env_idx]
                 del self.wa_send[env_idx]
                 del self.wa_recv[env_idx]
-                del self.trajectory[env_idx]
-                del self.meta_data[env_idx]
-                del self.intent[env_idx]
-                del self.state_info[env_idx]
 
                 print(f"Environment {env_idx} closed successfully.")
             except Exception as e:
                 print(f"Error while closing environment {env_idx}: {e}")
+        # also when the env never got reset or failed to close
+        for d in (self.trajectory, self.meta_data, self.intent, self.state_info):
+            d.pop(env_idx, None)
+        self.release_image_buffer(env_idx)
         return 0
 
 
@@ -7,6 +7,7 @@ import argparse
 
 from .utils import debug_flg
 from .server import app
+from .environment import webarena_env_server
 
 
 class CustomGunicornApp(BaseApplication):
@@ -30,8 +31,29 @@ def launch():
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=8000)
     parser.add_argument("--host", type=str, default="0.0.0.0")
-    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="envs live in one process; to use more, run several workers behind "
+        "`python -m agentenv.controller.env_router`",
+    )
+    parser.add_argument(
+        "--browsers",
+        type=int,
+        default=None,
+        help="share this many browser processes among all envs, "
+        "default $AGENTENV_WEBARENA_BROWSERS or one browser per env",
+    )
     args = parser.parse_args()
+    if args.workers > 1:
+        # every worker would own only the envs it created itself
+        parser.error(
+            "envs live in one process, so --workers must be 1; to use more, "
+            "run several workers behind `python -m agentenv.controller.env_router`"
+        )
+    if args.browsers is not None:
+        webarena_env_server.num_browsers = args.browsers
 
     options = {
         "bind": "{}:{}".format(args.host, args.port),
@@ -4,7 +4,7 @@ import time
 from collections import defaultdict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Union
+from typing import Any, Generator, Iterator, TypeVar, Union
 
 import numpy as np
 import numpy.typing as npt
@@ -13,9 +13,14 @@ from beartype.door import is_bearable
 from gymnasium import Env
 from gymnasium.spaces import Box, Text
 from playwright.sync_api import (
+    Browser,
+    BrowserContext,
     CDPSession,
+    Error as PlaywrightError,
     Page,
     Playwright,
+    Request,
+    TimeoutError as PlaywrightTimeoutError,
     ViewportSize,
     expect,
     sync_playwright,
@@ -31,6 +36,77 @@ from .utils import (
 )
 
 
+# returns the ready state of the document and the milliseconds since its DOM
+# last changed, watching the DOM from the first call on each document
+SETTLE_PROBE_JS = """
+() => {
+    if (window.__settleLastMutation === undefined) {
+        window.__settleLastMutation = performance.now();
+        new MutationObserver(() => {
+            window.__settleLastMutation = performance.now();
+        }).observe(document, {
+            attributes: true,
+            characterData: true,
+            childList: true,
+            subtree: true,
+        });
+    }
+    return [document.readyState, performance.now() - window.__settleLastMutation];
+}
+"""
+
+# seconds between two checks whether a page has settled
+SETTLE_POLL_INTERVAL = 0.05
+
+T = TypeVar("T")
+
+
+class NetworkActivity:
+    """
+    Tracks the requests in flight in a browser context and the time of its
+    last request or navigation, from before an action runs until it settles.
+    """
+
+    # requests that stay open for as long as the page
+    IGNORED_RESOURCE_TYPES = ("eventsource", "websocket")
+
+    def __init__(self, context: BrowserContext, page: Page) -> None:
+        self.context = context
+        self.page = page
+        self.in_flight: set[Request] = set()
+        self.last_event = time.monotonic()
+        self.context.on("request", self._on_request)
+        self.context.on("requestfinished", self._on_request_done)
+        self.context.on("requestfailed", self._on_request_done)
+        self.context.on("page", self._on_event)
+        self.page.on("framenavigated", self._on_event)
+
+    def _on_request(self, request: Request) -> None:
+        if request.resource_type not in self.IGNORED_RESOURCE_TYPES:
+            self.in_flight.add(request)
+        self.last_event = time.monotonic()
+
+    def _on_request_done(self, request: Request) -> None:
+        self.in_flight.discard(request)
+        self.last_event = time.monotonic()
+
+    def _on_event(self, _: Any) -> None:
+        self.last_event = time.monotonic()
+
+    def idle_time(self) -> float:
+        """Seconds without requests in flight, requests or navigations"""
+        if self.in_flight:
+            return 0.0
+        return time.monotonic() - self.last_event
+
+    def stop(self) -> None:
+        self.context.remove_listener("request", self._on_request)
+        self.context.remove_listener("requestfinished", self._on_request_done)
+        self.context.remove_listener("requestfailed", self._on_request_done)
+        self.context.remove_listener("page", self._on_event)
+        self.page.remove_listener("framenavigated", self._on_event)
+
+
 @dataclass
 class PlaywrightScript:
     function: str  # goto, get_by_role
@@ -71,6 +147,10 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
     range of action spaces and observation spaces, both structured and unstructured.
     But in this prototype, we just support action space specified by Playwright script,
     and observation space is the html content of the page.
+
+    By default every reset launches a new browser. Pass a `browser` to open each
+    episode in a new context of that browser instead, so that many envs of the
+    same thread can share one Chromium process.
     """
 
     @beartype
@@ -84,6 +164,10 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
         save_trace_enabled: bool = False,
         sleep_after_execution: float = 0.0,
+        settle_mode: str = "sleep",
+        settle_timeout: float = 5.0,
+        settle_quiet_time: float = 0.1,
+        browser: Browser | None = None,
     ):
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
@@ -94,6 +178,15 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         self.viewport_size = viewport_size
         self.save_trace_enabled = save_trace_enabled
         self.sleep_after_execution = sleep_after_execution
+        self.settle_timeout = settle_timeout
+        self.settle_quiet_time = settle_quiet_time
+        self.shared_browser = browser
+
+        match settle_mode:
+            case "sleep" | "adaptive":
+                self.settle_mode = settle_mode
+            case _:
+                raise ValueError(f"Unsupported settle mode: {settle_mode}")
 
         match observation_type:
             case "html" | "accessibility_tree":
@@ -123,11 +216,14 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
 
     @beartype
     def setup(self, config_file: Path | None = None) -> None:
-        self.context_manager = sync_playwright()
-        self.playwright = self.context_manager.__enter__()
-        self.browser = self.playwright.chromium.launch(
-            headless=self.headless, slow_mo=self.slow_mo
-        )
+        if self.shared_browser is None:
+            self.context_manager = sync_playwright()
+            self.playwright = self.context_manager.__enter__()
+            self.browser = self.playwright.chromium.launch(
+                headless=self.headless, slow_mo=self.slow_mo
+            )
+        else:
+            self.browser = self.shared_browser
 
         if config_file:
             with open(config_file, "r") as f:
@@ -180,6 +276,13 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
                 client.send("Accessibility.enable")
             self.page.client = client  # type: ignore
 
+    def teardown(self) -> None:
+        """Close the browser of the episode, or only its context if shared"""
+        if self.shared_browser is None:
+            self.context_manager.__exit__()
+        else:
+            self.context.close()
+
     def get_page_client(self, page: Page) -> CDPSession:
         if hasattr(page, "client"):
             return page.client  # type: ignore
@@ -188,6 +291,72 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             page.client = client  # type: ignore
             return client
 
+    def settling(self, activity: NetworkActivity | None = None) -> Iterator[None]:
+        """
+        Yield until the current page has settled after an action.
+
+        In "sleep" mode, yield for `sleep_after_execution` seconds. In
+        "adaptive" mode, yield until no request has been in flight and nothing
+        has navigated for `settle_quiet_time` seconds, the page has loaded and
+        its DOM has not changed for as long, or for `settle_timeout` seconds at
+        most, after which the page is observed as is. `activity` should be
+        watching from before the action, since clicks and key presses return
+        before the navigation they trigger starts.
+        """
+        if self.settle_mode == "sleep":
+            if activity is not None:
+                activity.stop()
+            deadline = time.monotonic() + self.sleep_after_execution
+            while time.monotonic() < deadline:
+                yield
+            return
+
+        if activity is None:
+            activity = NetworkActivity(self.context, self.page)
+        deadline = time.monotonic() + self.settle_timeout
+        try:
+            while time.monotonic() < deadline:
+                if (
+                    activity.idle_time() >= self.settle_quiet_time
+                    and self.is_page_quiet()
+                ):
+                    return
+                yield
+        finally:
+            activity.stop()
+
+    def is_page_quiet(self) -> bool:
+        """Whether the current page has loaded and its DOM stopped changing"""
+        if self.page.is_closed():
+            return True
+        try:
+            ready_state, idle_ms = self.page.evaluate(SETTLE_PROBE_JS)
+        except PlaywrightError:
+            # the page navigated while it was probed
+            return False
+        return ready_state == "complete" and idle_ms >= self.settle_quiet_time * 1000
+
+    def pause(self, seconds: float) -> None:
+        """Wait, delivering the events of the browser meanwhile"""
+        try:
+            # the sync API only delivers events while it waits on playwright
+            self.page.wait_for_timeout(seconds * 1000)
+        except PlaywrightError:
+            time.sleep(seconds)
+
+    def run_settling(self, steps: Generator[None, None, T]) -> T:
+        """Run `steps` of e.g. `step_settling` to the end, pausing whenever they yield"""
+        while True:
+            try:
+                next(steps)
+            except StopIteration as e:
+                return e.value
+            self.pause(SETTLE_POLL_INTERVAL)
+
+    def wait_for_settle(self, activity: NetworkActivity | None = None) -> None:
+        """Wait for the current page to settle after an action, see `settling`"""
+        self.run_settling(self.settling(activity))
+
     def _get_obs(self) -> dict[str, Observation]:
         obs = self.observation_handler.get_observation(
             self.page, self.get_page_client(self.page)
@@ -210,9 +379,21 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         :param options: options for the environment. The current supported options are:
             - "storage_state": the storage state of the browser. It is a file path to a json file.
         """
+        return self.run_settling(self.reset_settling(seed=seed, options=options))
+
+    def reset_settling(
+        self,
+        *,
+        seed: int | None = None,
+        options: dict[str, str] | None = None,
+    ) -> Generator[None, None, tuple[dict[str, Observation], dict[str, Any]]]:
+        """
+        Like `reset`, but yield while the page settles, so that one thread can
+        drive the envs of many contexts of a browser.
+        """
         super().reset(seed=seed, options=options)
         if self.reset_finished:
-            self.context_manager.__exit__()
+            self.teardown()
 
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
@@ -230,8 +411,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
                 raise e
         self.reset_finished = True
 
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+        yield from self.settling()
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
@@ -249,16 +429,27 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
 
     def close(self) -> None:
         if self.reset_finished:
-            self.context_manager.__exit__()
+            self.teardown()
 
     def step(
         self, action: Action
     ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
+        return self.run_settling(self.step_settling(action))
+
+    def step_settling(
+        self, action: Action
+    ) -> Generator[
+        None, None, tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]
+    ]:
+        """Like `step`, but yield while the page settles, see `reset_settling`"""
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
 
         success = False
         fail_error = ""
+        activity = None
+        if self.settle_mode == "adaptive":
+            activity = NetworkActivity(self.context, self.page)
         try:
             self.page = execute_action(
                 action,
@@ -270,9 +461,7 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         except Exception as e:
             fail_error = str(e)
 
-        # hard sleep TODO[shuyanzh] suboptimal, may need to check network
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+        yield from self.settling(activity)
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
@@ -1,7 +1,7 @@
 import json
 import re
 from collections import defaultdict
-from typing import Any, TypedDict, Union
+from typing import Any, Callable, TypedDict, Union
 
 import base64
 import io
@@ -142,6 +142,51 @@ class TextObervationProcessor(ObservationProcessor):
         except Exception as e:
             return {"result": {"subtype": "error"}}
 
+    @staticmethod
+    def get_union_bound(
+        client: CDPSession, backend_node_id: str
+    ) -> list[float] | None:
+        response = TextObervationProcessor.get_bounding_client_rect(
+            client, backend_node_id
+        )
+        if response.get("result", {}).get("subtype", "") == "error":
+            return None
+        x = response["result"]["value"]["x"]
+        y = response["result"]["value"]["y"]
+        width = response["result"]["value"]["width"]
+        height = response["result"]["value"]["height"]
+        return [x, y, width, height]
+
+    @staticmethod
+    def get_bounding_client_rects(info: BrowserInfo) -> dict[str, list[float]]:
+        """
+        Bounds of the nodes of the main document, by backend node id, read
+        from the DOM snapshot already taken by `fetch_browser_info` instead of
+        two CDP round trips per node. Layout bounds are page coordinates, so
+        the scroll offset is subtracted to match `getBoundingClientRect`.
+        Nodes without a layout object are not rendered and get a zero rect.
+        """
+        document = info["DOMTree"]["documents"][0]
+        backend_node_ids = document["nodes"]["backendNodeId"]
+        layout = document["layout"]
+        left = info["config"]["win_left_bound"]
+        top = info["config"]["win_top_bound"]
+
+        rects = {
+            str(backend_node_id): [0.0, 0.0, 0.0, 0.0]
+            for backend_node_id in backend_node_ids
+        }
+        for node_index, (x, y, width, height) in zip(
+            layout["nodeIndex"], layout["bounds"]
+        ):
+            rects[str(backend_node_ids[node_index])] = [
+                x - left,
+                y - top,
+                width,
+                height,
+            ]
+        return rects
+
     @staticmethod
     def get_element_in_viewport_ratio(
         elem_left_bound: float,
@@ -174,6 +219,62 @@ class TextObervationProcessor(ObservationProcessor):
         ratio = overlap_width * overlap_height / width * height
         return ratio
 
+    def in_viewport(
+        self, union_bound: list[float] | None, config: BrowserConfig
+    ) -> bool:
+        if not union_bound:
+            return False
+
+        [x, y, width, height] = union_bound
+
+        # invisible node
+        if width == 0 or height == 0:
+            return False
+
+        in_viewport_ratio = self.get_element_in_viewport_ratio(
+            elem_left_bound=float(x),
+            elem_top_bound=float(y),
+            width=float(width),
+            height=float(height),
+            config=config,
+        )
+        return in_viewport_ratio >= IN_VIEWPORT_RATIO_THRESHOLD
+
+    @staticmethod
+    def prune_tree(
+        tree: list[Any], keep: Callable[[Any], bool]
+    ) -> list[Any]:
+        """
+        Remove the nodes of `tree` for which `keep` is false. The children of
+        a removed node take its place in the parent's `childIds`, and every
+        kept node's `parentId` becomes its nearest kept ancestor. Each kept
+        node's child list is rebuilt once, in a single pass over the tree.
+        """
+        node_by_id = {node["nodeId"]: node for node in tree}
+        removed = {node["nodeId"] for node in tree if not keep(node)}
+
+        for node in tree:
+            if node["nodeId"] in removed:
+                continue
+            child_ids = []
+            stack = [iter(node["childIds"])]
+            while stack:
+                for child_id in stack[-1]:
+                    if child_id in removed:
+                        # splice in the removed child's own children
+                        stack.append(iter(node_by_id[child_id]["childIds"]))
+                        break
+                    child_ids.append(child_id)
+                    if child_id in node_by_id:
+                        node_by_id[child_id]["parentId"] = node["nodeId"]
+                else:
+                    stack.pop()
+            node["childIds"] = child_ids
+
+        for node_id in removed:
+            node_by_id[node_id]["parentId"] = "[REMOVED]"
+        return [node for node in tree if node["nodeId"] not in removed]
+
     def fetch_page_html(
         self,
         info: BrowserInfo,
@@ -187,6 +288,8 @@ class TextObervationProcessor(ObservationProcessor):
         document = tree["documents"][0]
         nodes = document["nodes"]
 
+        rects = self.get_bounding_client_rects(info)
+
         # make a dom tree that is easier to navigate
         dom_tree: DOMTree = []
         graph = defaultdict(list)
@@ -242,17 +345,7 @@ class TextObervationProcessor(ObservationProcessor):
             if cur_node["parentId"] == "-1":
                 cur_node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
             else:
-                response = self.get_bounding_client_rect(
-                    client, cur_node["backendNodeId"]
-                )
-                if response.get("result", {}).get("subtype", "") == "error":
-                    cur_node["union_bound"] = None
-                else:
-                    x = response["result"]["value"]["x"]
-                    y = response["result"]["value"]["y"]
-                    width = response["result"]["value"]["width"]
-                    height = response["result"]["value"]["height"]
-                    cur_node["union_bound"] = [x, y, width, height]
+                cur_node["union_bound"] = rects[cur_node["backendNodeId"]]
 
             dom_tree.append(cur_node)
 
@@ -262,61 +355,11 @@ class TextObervationProcessor(ObservationProcessor):
 
         # remove the nodes that are not in the current viewport
         if current_viewport_only:
-
-            def remove_node_in_graph(node: DOMNode) -> None:
-                # update the node information in the accessibility tree
-                node_id = node["nodeId"]
-                parent_id = node["parentId"]
-                child_ids = node["childIds"]
-
-                # update the children of the parent node
-                assert dom_tree[int(parent_id)]["parentId"] != "[REMOVED]"
-                # remove the nodeid from parent
-                index = dom_tree[int(parent_id)]["childIds"].index(node_id)
-                dom_tree[int(parent_id)]["childIds"].pop(index)
-
-                # Insert children_nodeids in the same location
-                for child_id in child_ids:
-                    dom_tree[int(parent_id)]["childIds"].insert(
-                        index, child_id
-                    )
-                    index += 1
-
-                # update children node's parent
-                for child_id in child_ids:
-                    dom_tree[int(child_id)]["parentId"] = parent_id
-                # mark as removed
-                dom_tree[int(node_id)]["parentId"] = "[REMOVED]"
-
             config = info["config"]
-            for cursor, node in enumerate(dom_tree):
-                if not node["union_bound"]:
-                    remove_node_in_graph(node)
-                    continue
-
-                [x, y, width, height] = node["union_bound"]
-
-                # invisible node
-                if width == 0.0 or height == 0.0:
-                    remove_node_in_graph(node)
-                    continue
-
-                in_viewport_ratio = self.get_element_in_viewport_ratio(
-                    elem_left_bound=float(x),
-                    elem_top_bound=float(y),
-                    width=float(width),
-                    height=float(height),
-                    config=config,
-                )
-
-                if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                    remove_node_in_graph(node)
-
-            dom_tree = [
-                node
-                for node in dom_tree
-                if node.get("parentId", "-1") != "[REMOVED]"
-            ]
+            dom_tree = self.prune_tree(
+                dom_tree,
+                lambda node: self.in_viewport(node["union_bound"], config),
+            )
 
         return dom_tree
 
@@ -329,8 +372,11 @@ class TextObervationProcessor(ObservationProcessor):
             node["nodeId"]: idx for idx, node in enumerate(dom_tree)
         }
 
-        def dfs(node_cursor: int, depth: int) -> str:
-            tree_str = ""
+        lines = []
+        # iterative pre-order walk, deep pages overflow the recursion limit
+        stack = [(0, 0)]
+        while stack:
+            node_cursor, depth = stack.pop()
             node = dom_tree[node_cursor]
             indent = "\t" * depth
             valid_node = True
@@ -347,20 +393,16 @@ class TextObervationProcessor(ObservationProcessor):
                         "union_bound": node["union_bound"],
                         "text": node_str,
                     }
-                    tree_str += f"{indent}{node_str}\n"
+                    lines.append(f"{indent}{node_str}\n")
 
             except Exception as e:
                 valid_node = False
 
-            for child_ids in node["childIds"]:
-                child_cursor = nodeid_to_cursor[child_ids]
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(child_cursor, child_depth)
-                tree_str += child_str
-
-            return tree_str
+            child_depth = depth + 1 if valid_node else depth
+            for child_ids in reversed(node["childIds"]):
+                stack.append((nodeid_to_cursor[child_ids], child_depth))
 
-        html = dfs(0, 0)
+        html = "".join(lines)
         return html, obs_nodes_info
 
     def fetch_page_accessibility_tree(
@@ -382,6 +424,7 @@ class TextObervationProcessor(ObservationProcessor):
                 seen_ids.add(node["nodeId"])
         accessibility_tree = _accessibility_tree
 
+        rects = self.get_bounding_client_rects(info)
         nodeid_to_cursor = {}
         for cursor, node in enumerate(accessibility_tree):
             nodeid_to_cursor[node["nodeId"]] = cursor
@@ -393,83 +436,21 @@ class TextObervationProcessor(ObservationProcessor):
             if node["role"]["value"] == "RootWebArea":
                 # always inside the viewport
                 node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
+            elif backend_node_id in rects:
+                node["union_bound"] = rects[backend_node_id]
             else:
-                response = self.get_bounding_client_rect(
+                # e.g. a node in an iframe or added after the snapshot
+                node["union_bound"] = self.get_union_bound(
                     client, backend_node_id
                 )
-                if response.get("result", {}).get("subtype", "") == "error":
-                    node["union_bound"] = None
-                else:
-                    x = response["result"]["value"]["x"]
-                    y = response["result"]["value"]["y"]
-                    width = response["result"]["value"]["width"]
-                    height = response["result"]["value"]["height"]
-                    node["union_bound"] = [x, y, width, height]
 
         # filter nodes that are not in the current viewport
         if current_viewport_only:
-
-            def remove_node_in_graph(node: AccessibilityTreeNode) -> None:
-                # update the node information in the accessibility tree
-                nodeid = node["nodeId"]
-                node_cursor = nodeid_to_cursor[nodeid]
-                parent_nodeid = node["parentId"]
-                children_nodeids = node["childIds"]
-                parent_cursor = nodeid_to_cursor[parent_nodeid]
-                # update the children of the parent node
-                assert (
-                    accessibility_tree[parent_cursor].get("parentId", "Root")
-                    is not None
-                )
-                # remove the nodeid from parent's childIds
-                index = accessibility_tree[parent_cursor]["childIds"].index(
-                    nodeid
-                )
-                accessibility_tree[parent_cursor]["childIds"].pop(index)
-                # Insert children_nodeids in the same location
-                for child_nodeid in children_nodeids:
-                    accessibility_tree[parent_cursor]["childIds"].insert(
-                        index, child_nodeid
-                    )
-                    index += 1
-                # update children node's parent
-                for child_nodeid in children_nodeids:
-                    child_cursor = nodeid_to_cursor[child_nodeid]
-                    accessibility_tree[child_cursor][
-                        "parentId"
-                    ] = parent_nodeid
-                # mark as removed
-                accessibility_tree[node_cursor]["parentId"] = "[REMOVED]"
-
             config = info["config"]
-            for node in accessibility_tree:
-                if not node["union_bound"]:
-                    remove_node_in_graph(node)
-                    continue
-
-                [x, y, width, height] = node["union_bound"]
-
-                # invisible node
-                if width == 0 or height == 0:
-                    remove_node_in_graph(node)
-                    continue
-
-                in_viewport_ratio = self.get_element_in_viewport_ratio(
-                    elem_left_bound=float(x),
-                    elem_top_bound=float(y),
-                    width=float(width),
-                    height=float(height),
-                    config=config,
-                )
-
-                if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                    remove_node_in_graph(node)
-
-            accessibility_tree = [
-                node
-                for node in accessibility_tree
-                if node.get("parentId", "Root") != "[REMOVED]"
-            ]
+            accessibility_tree = self.prune_tree(
+                accessibility_tree,
+                lambda node: self.in_viewport(node["union_bound"], config),
+            )
 
         return accessibility_tree
 
@@ -484,8 +465,11 @@ class TextObervationProcessor(ObservationProcessor):
 
         obs_nodes_info = {}
 
-        def dfs(idx: int, obs_node_id: str, depth: int) -> str:
-            tree_str = ""
+        lines = []
+        # iterative pre-order walk, deep pages overflow the recursion limit
+        stack = [(0, accessibility_tree[0]["nodeId"], 0)]
+        while stack:
+            idx, obs_node_id, depth = stack.pop()
             node = accessibility_tree[idx]
             indent = "\t" * depth
             valid_node = True
@@ -532,7 +516,7 @@ class TextObervationProcessor(ObservationProcessor):
                         valid_node = False
 
                 if valid_node:
-                    tree_str += f"{indent}{node_str}"
+                    lines.append(f"{indent}{node_str}")
                     obs_nodes_info[obs_node_id] = {
                         "backend_id": node["backendDOMNodeId"],
                         "union_bound": node["union_bound"],
@@ -542,22 +526,16 @@ class TextObervationProcessor(ObservationProcessor):
             except Exception as e:
                 valid_node = False
 
-            for _, child_node_id in enumerate(node["childIds"]):
+            # mark this to save some tokens
+            child_depth = depth + 1 if valid_node else depth
+            for child_node_id in reversed(node["childIds"]):
                 if child_node_id not in node_id_to_idx:
                     continue
-                # mark this to save some tokens
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(
-                    node_id_to_idx[child_node_id], child_node_id, child_depth
+                stack.append(
+                    (node_id_to_idx[child_node_id], child_node_id, child_depth)
                 )
-                if child_str.strip():
-                    if tree_str.strip():
-                        tree_str += "\n"
-                    tree_str += child_str
-
-            return tree_str
 
-        tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+        tree_str = "\n".join(lines)
         return tree_str, obs_nodes_info
 
     @staticmethod
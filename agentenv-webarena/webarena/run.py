@@ -87,6 +87,14 @@ def config() -> argparse.Namespace:
     parser.add_argument("--viewport_height", type=int, default=720)
     parser.add_argument("--save_trace_enabled", action="store_true")
     parser.add_argument("--sleep_after_execution", type=float, default=0.0)
+    parser.add_argument(
+        "--settle_mode",
+        type=str,
+        default="sleep",
+        choices=["sleep", "adaptive"],
+        help="sleep after each action, or wait until the page settles",
+    )
+    parser.add_argument("--settle_timeout", type=float, default=5.0)
 
     parser.add_argument("--max_steps", type=int, default=30)
 
@@ -238,6 +246,8 @@ def test(
         },
         save_trace_enabled=args.save_trace_enabled,
         sleep_after_execution=args.sleep_after_execution,
+        settle_mode=args.settle_mode,
+        settle_timeout=args.settle_timeout,
     )
 
     for config_file in config_file_list:
@@ -0,0 +1,239 @@
+"""Micro-benchmark of the text observation processor on recorded pages.
+
+Record the CDP dumps of a few pages once, with a browser and the sites up:
+
+    python scripts/benchmark_processors.py record dumps/ URL [URL ...]
+
+then time pruning and serialization offline, e.g. before and after a change:
+
+    python scripts/benchmark_processors.py run dumps/*.json
+    python scripts/benchmark_processors.py run --synthetic 5000
+
+A dump holds the output of `fetch_browser_info` and of
+`Accessibility.getFullAXTree`, which is all `fetch_page_html` and
+`fetch_page_accessibility_tree` read from the browser.
+"""
+import argparse
+import copy
+import json
+import os
+import re
+import time
+from typing import Any
+
+from browser_env.processors import TextObervationProcessor
+
+VIEWPORT_SIZE = {"width": 1280, "height": 720}
+
+
+class ReplayCDPSession:
+    """Answers the CDP calls of the processor from a recorded dump"""
+
+    def __init__(self, ax_trees: list[dict[str, Any]]) -> None:
+        self.ax_trees = ax_trees
+
+    def send(self, method: str, params: Any = None) -> dict[str, Any]:
+        if method == "Accessibility.getFullAXTree":
+            return self.ax_trees.pop()
+        # bounds of nodes missing from the snapshot are not recorded
+        raise RuntimeError(f"{method} is not recorded")
+
+
+def record(out_dir: str, urls: list[str]) -> None:
+    from playwright.sync_api import sync_playwright
+
+    os.makedirs(out_dir, exist_ok=True)
+    processor = TextObervationProcessor(
+        "accessibility_tree", True, VIEWPORT_SIZE
+    )
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        page = browser.new_page(viewport=VIEWPORT_SIZE)
+        client = page.context.new_cdp_session(page)
+        for url in urls:
+            page.goto(url)
+            page.wait_for_load_state("load")
+            dump = {
+                "url": url,
+                "info": processor.fetch_browser_info(page, client),
+                "ax_tree": client.send("Accessibility.getFullAXTree", {}),
+            }
+            name = re.sub(r"[^A-Za-z0-9]+", "_", url).strip("_")
+            path = os.path.join(out_dir, f"{name}.json")
+            with open(path, "w") as f:
+                json.dump(dump, f)
+            print(f"Recorded {url} to {path}.")
+        browser.close()
+
+
+def synthesize(width: int) -> dict[str, Any]:
+    """
+    A page whose body has `width` small tiles with a text node each, tiled so
+    that the first few thousand are inside the viewport, and each followed by
+    an empty span that is not rendered
+    """
+    strings = ["#document", "HTML", "BODY", "DIV", "#text", "item", "SPAN"]
+    columns = VIEWPORT_SIZE["width"] // 40
+    node_type, node_name, node_value = [9, 1, 1], [0, 1, 2], [-1, -1, -1]
+    parent_index, backend_ids = [-1, 0, 1], [1, 2, 3]
+    layout_index = [1, 2]
+    height = 10 * (width // columns + 1)
+    bounds = [[0, 0, VIEWPORT_SIZE["width"], height]] * 2
+    ax_nodes = [
+        {
+            "nodeId": "1",
+            "role": {"value": "RootWebArea"},
+            "name": {"value": "synthetic"},
+            "backendDOMNodeId": 1,
+            "childIds": ["3"],
+        },
+        {
+            "nodeId": "3",
+            "role": {"value": "generic"},
+            "name": {"value": ""},
+            "backendDOMNodeId": 3,
+            "parentId": "1",
+            "childIds": [],
+        },
+    ]
+    for i in range(width):
+        div, text, span = range(len(node_type), len(node_type) + 3)
+        node_type += [1, 3, 1]
+        node_name += [3, 4, 6]
+        node_value += [-1, 5, -1]
+        parent_index += [2, div, 2]
+        backend_ids += [div + 1, text + 1, span + 1]
+        layout_index += [div, text]
+        bounds += [[40 * (i % columns), 10 * (i // columns), 40, 10]] * 2
+        ax_nodes[1]["childIds"] += [str(div + 1), str(span + 1)]
+        ax_nodes.append(
+            {
+                "nodeId": str(div + 1),
+                "role": {"value": "link"},
+                "name": {"value": f"item {i}"},
+                "properties": [
+                    {"name": "focusable", "value": {"value": True}}
+                ],
+                "backendDOMNodeId": div + 1,
+                "parentId": "3",
+                "childIds": [str(text + 1)],
+            }
+        )
+        ax_nodes.append(
+            {
+                "nodeId": str(text + 1),
+                "role": {"value": "StaticText"},
+                "name": {"value": f"item {i}"},
+                "backendDOMNodeId": text + 1,
+                "parentId": str(div + 1),
+                "childIds": [],
+            }
+        )
+        ax_nodes.append(
+            {
+                "nodeId": str(span + 1),
+                "role": {"value": "generic"},
+                "name": {"value": ""},
+                "backendDOMNodeId": span + 1,
+                "parentId": "3",
+                "childIds": [],
+            }
+        )
+    document = {
+        "nodes": {
+            "nodeType": node_type,
+            "nodeName": node_name,
+            "nodeValue": node_value,
+            "attributes": [[] for _ in node_type],
+            "backendNodeId": backend_ids,
+            "parentIndex": parent_index,
+        },
+        "layout": {"nodeIndex": layout_index, "bounds": bounds},
+    }
+    config = {
+        "win_top_bound": 0.0,
+        "win_left_bound": 0.0,
+        "win_width": VIEWPORT_SIZE["width"],
+        "win_height": VIEWPORT_SIZE["height"],
+        "win_right_bound": VIEWPORT_SIZE["width"],
+        "win_lower_bound": VIEWPORT_SIZE["height"],
+        "device_pixel_ratio": 1.0,
+    }
+    return {
+        "url": f"synthetic://{width}",
+        "info": {
+            "DOMTree": {"documents": [document], "strings": strings},
+            "config": config,
+        },
+        "ax_tree": {"nodes": ax_nodes},
+    }
+
+
+def benchmark(dump: dict[str, Any], repeat: int) -> None:
+    for observation_type in ["html", "accessibility_tree"]:
+        for current_viewport_only in [False, True]:
+            processor = TextObervationProcessor(
+                observation_type, current_viewport_only, VIEWPORT_SIZE
+            )
+            # the processor mutates its inputs, so every run gets a fresh copy
+            client = ReplayCDPSession(
+                [copy.deepcopy(dump["ax_tree"]) for _ in range(repeat)]
+            )
+            fetch_time, parse_time = 0.0, 0.0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                if observation_type == "html":
+                    tree = processor.fetch_page_html(
+                        dump["info"], None, client, current_viewport_only
+                    )
+                    fetched = time.perf_counter()
+                    content, _ = processor.parse_html(tree)
+                else:
+                    tree = processor.fetch_page_accessibility_tree(
+                        dump["info"], client, current_viewport_only
+                    )
+                    fetched = time.perf_counter()
+                    content, _ = processor.parse_accessibility_tree(tree)
+                end = time.perf_counter()
+                fetch_time += fetched - start
+                parse_time += end - fetched
+            print(
+                f"{dump['url']}\t{observation_type}\t"
+                f"viewport_only={current_viewport_only}\t"
+                f"nodes={len(tree)}\tchars={len(content)}\t"
+                f"fetch={fetch_time / repeat * 1000:.2f}ms\t"
+                f"parse={parse_time / repeat * 1000:.2f}ms"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="record CDP dumps")
+    record_parser.add_argument("out_dir", type=str)
+    record_parser.add_argument("urls", type=str, nargs="+")
+    run_parser = subparsers.add_parser("run", help="time recorded dumps")
+    run_parser.add_argument("dumps", type=str, nargs="*")
+    run_parser.add_argument(
+        "--synthetic",
+        type=int,
+        nargs="*",
+        default=[],
+        help="also time synthetic pages with this many items",
+    )
+    run_parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.out_dir, args.urls)
+        return
+
+    for path in args.dumps:
+        with open(path, "r") as f:
+            benchmark(json.load(f), args.repeat)
+    for width in args.synthetic:
+        benchmark(synthesize(width), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
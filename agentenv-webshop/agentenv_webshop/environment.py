@@ -2,6 +2,7 @@
 WebshopEnvServer
 """
 
+import threading
 from typing import Optional
 
 import gym
@@ -19,29 +20,49 @@ class WebshopEnvServer:
         self.ls = []
         self.sz = 8000
         self.now = -1
+        self._lock = threading.Lock()
+        # ids of the envs being built, which count towards `sz`
+        self._pending = set()
+        self._env_built = threading.Condition(self._lock)
 
     def create(self) -> int:
-        env_idx = self._max_id
         import random
         import time
 
-        random.seed(time.time())
-        idx = random.randint(0, 48950076)
-        print(f"-------Env {idx} created--------")
-        if len(self.env) == self.sz:
-            self.now = self.now + 1
-            if self.now == self.sz:
-                self.now = 0
-            return self.ls[self.now]
-
-        self.env[idx] = gym.make(
-            "WebAgentTextEnv-v0",
-            observation_mode="text",
-            num_products=1000,
-        )
-        self.env[idx].reset()
-        self._max_id += 1
-        self.ls.append(idx)
+        with self._lock:
+            random.seed(time.time())
+            while len(self.env) + len(self._pending) >= self.sz and not self.ls:
+                # every slot is taken by an env that is still being built
+                self._env_built.wait()
+            if len(self.env) + len(self._pending) >= self.sz:
+                self.now = (self.now + 1) % len(self.ls)
+                return self.ls[self.now]
+            idx = random.randint(0, 48950076)
+            while idx in self.env or idx in self._pending:
+                idx = random.randint(0, 48950076)
+            print(f"-------Env {idx} created--------")
+            self._pending.add(idx)
+            self._max_id += 1
+
+        # building the env is the slow part, so it runs outside the lock
+        try:
+            env = gym.make(
+                "WebAgentTextEnv-v0",
+                observation_mode="text",
+                num_products=1000,
+                shared_server=True,
+            )
+            env.reset()
+        except Exception:
+            with self._lock:
+                self._pending.discard(idx)
+                self._env_built.notify_all()
+            raise
+        with self._lock:
+            self._pending.discard(idx)
+            self.env[idx] = env
+            self.ls.append(idx)
+            self._env_built.notify_all()
         return idx
 
     def step(self, env_idx, action: str):
@@ -6,6 +6,7 @@ import logging
 import time
 from typing import List, Tuple
 
+from anyio import to_thread
 from fastapi import FastAPI, Request
 
 from .environment import webshop_env_server
@@ -40,8 +41,19 @@ async def list_envs():
     return list(webshop_env_server.env.keys())
 
 
+@app.get("/stats")
+async def stats():
+    """Handlers running in and waiting for the worker thread pool"""
+    limiter = to_thread.current_default_thread_limiter().statistics()
+    return {
+        "threads": limiter.total_tokens,
+        "running": limiter.borrowed_tokens,
+        "queue_depth": limiter.tasks_waiting,
+    }
+
+
 @app.post("/create", response_model=int)
-async def create():
+def create():
     """Create a new environment"""
     env = webshop_env_server.create()
 
@@ -197,4 +197,33 @@ def test_get_reward():
     purchased['query'] = "Query 2"
     purchased['product_category'] = "a › d › e"
     total_reward = get_reward(purchased, goal, 35, purchased['goal_options'])
-    assert isclose(total_reward, 0.2857, abs_tol=1e-2)
\ No newline at end of file
+    assert isclose(total_reward, 0.2857, abs_tol=1e-2)
+
+
+def test_get_rewards():
+    goal = {
+        'query': "Query 1",
+        'product_category': "a › b › c",
+        'name': "Mens D.O.N. Issue 2 Gca Basketball Sneakers Shoes Casual - Off White",
+        'attributes': ["tea tree", "essential oils", "natural ingredients"],
+        'goal_options': {"color": "grey", "size": "XL"},
+        'price_upper': 40.00
+    }
+    purchased = {
+        'query': "Query 1",
+        'product_category': "a › b › c",
+        'name': "Mens D.O.N. Issue 2 Gca Basketball Sneakers Shoes Casual - Off White",
+        'Attributes': ["tea tree", "essential oil", "natural ingredients"],
+        'Title': "",
+        'BulletPoints': [],
+        'Description': "",
+    }
+    other = dict(purchased, name="BRST AC Power Cord Outlet Socket Cable Plug", query="Query 2")
+    purchases = [
+        (purchased, goal, 35, {"color": "grey", "size": "XL"}),
+        (purchased, goal, 50, {"color": "grey"}),
+        (other, goal, 35, {"color": "grey", "size": "XL"}),
+    ]
+    rewards = get_rewards(purchases)
+    assert rewards == [get_reward(*purchase) for purchase in purchases]
+    assert rewards[0] == 1
@@ -0,0 +1,309 @@
+"""
+Compact, memory-mapped product catalog.
+
+`build_catalog` runs `load_products` once and writes its result to a directory
+of flat numpy columns plus a blob of pickled product records. `load_catalog`
+memory-maps that directory and returns the same values as `load_products`
+without parsing or cleaning anything, so server workers start in well under a
+second and share the catalog pages through the OS page cache. The fields that
+`get_goals` reads are kept apart for the few products with instructions, so
+building the goals does not decode every record either.
+
+Build a catalog with
+
+    python -m web_agent_site.engine.catalog data/items_shuffle.json data/catalog
+
+and pass the catalog directory wherever an items file path is expected.
+"""
+import argparse
+import json
+import os
+import pickle
+import random
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
+
+import numpy as np
+
+CATALOG_VERSION = 2
+ASIN_WIDTH = 10  # `load_products` drops longer ASINs
+INTERNED_FIELDS = ('category', 'query', 'product_category')
+# Product fields read by `get_human_goals` and `get_synthetic_goals`
+GOAL_FIELDS = (
+    'asin', 'category', 'query', 'name', 'product_category', 'Title',
+    'instructions', 'instruction_text', 'instruction_attributes', 'options',
+)
+
+
+def has_goals(product, human_goals):
+    if human_goals:
+        return 'instructions' in product
+    return product.get('instruction_text') is not None
+
+
+def build_catalog(filepath, out_dir, human_goals=True):
+    """Preprocess the items file at `filepath` into a catalog under `out_dir`"""
+    from web_agent_site.engine.engine import load_products
+
+    with open(filepath) as f:
+        source_asins = [p['asin'] for p in json.load(f)]
+    all_products, _, _, attribute_to_asins = \
+        load_products(filepath=filepath, human_goals=human_goals)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Position of every product in the items file, so `num_products` can
+    # still select the same prefix of the file at load time
+    source_idx = {}
+    for i, asin in enumerate(source_asins):
+        source_idx.setdefault(asin, i)
+
+    strings = {}
+    def intern(s):
+        return strings.setdefault(s, len(strings))
+
+    n = len(all_products)
+    columns = {
+        'asins': np.empty(n, dtype=f'S{ASIN_WIDTH}'),
+        'source_idx': np.empty(n, dtype=np.uint32),
+        'pricing': np.full((n, 2), np.nan, dtype=np.float64),
+        'offsets': np.empty(n + 1, dtype=np.uint64),
+    }
+    for field in INTERNED_FIELDS:
+        columns[field] = np.empty(n, dtype=np.uint32)
+
+    goal_products = []
+    offset = 0
+    with open(os.path.join(out_dir, 'records.bin'), 'wb') as f:
+        for row, p in enumerate(all_products):
+            columns['asins'][row] = p['asin'].encode()
+            columns['source_idx'][row] = source_idx[p['asin']]
+            columns['pricing'][row, :len(p['pricing'])] = p['pricing']
+            for field in INTERNED_FIELDS:
+                columns[field][row] = intern(p[field])
+            columns['offsets'][row] = offset
+            if has_goals(p, human_goals):
+                goal_products.append(
+                    (row, {field: p[field] for field in GOAL_FIELDS if field in p})
+                )
+            record = pickle.dumps(p, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(record)
+            offset += len(record)
+    columns['offsets'][n] = offset
+    columns['asin_order'] = np.argsort(columns['asins'], kind='stable').astype(np.uint32)
+
+    # attribute -> asins as a CSR matrix of row indices
+    row_of = {p['asin']: row for row, p in enumerate(all_products)}
+    attributes = sorted(attribute_to_asins)
+    attr_rows = [sorted(row_of[a] for a in attribute_to_asins[attr]) for attr in attributes]
+    columns['attr_offsets'] = np.cumsum([0] + [len(r) for r in attr_rows], dtype=np.uint64)
+    columns['attr_rows'] = np.fromiter(
+        (row for rows in attr_rows for row in rows), dtype=np.uint32,
+    )
+
+    for name, column in columns.items():
+        np.save(os.path.join(out_dir, f'{name}.npy'), column)
+    with open(os.path.join(out_dir, 'goal_products.pkl'), 'wb') as f:
+        pickle.dump(goal_products, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': CATALOG_VERSION,
+            'num_products': n,
+            'human_goals': bool(human_goals),
+            'strings': list(strings),
+            'attributes': attributes,
+        }, f)
+    print(f'Wrote catalog of {n} products to {out_dir}.')
+
+
+def is_catalog(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+class ProductCatalog(Sequence):
+    """Read-only sequence of product dicts backed by a memory-mapped catalog"""
+    def __init__(self, path, num_products=None, cache_size=65536):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != CATALOG_VERSION:
+            raise ValueError(
+                f'Catalog {path} has version {self.meta["version"]}, expected {CATALOG_VERSION}.'
+            )
+        self.strings = self.meta['strings']
+        self.string_ids = {s: i for i, s in enumerate(self.strings)}
+        self.attributes = {attr: i for i, attr in enumerate(self.meta['attributes'])}
+
+        def column(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+        self.asins = column('asins')
+        self.asin_order = column('asin_order')
+        self.pricing = column('pricing')
+        self.offsets = column('offsets')
+        self.attr_offsets = column('attr_offsets')
+        self.attr_rows = column('attr_rows')
+        self.interned = {field: column(field) for field in INTERNED_FIELDS}
+        self.records = np.memmap(os.path.join(path, 'records.bin'), dtype=np.uint8, mode='r') \
+            if self.offsets[-1] else np.empty(0, dtype=np.uint8)
+
+        # Same prefix of the items file as `products[:num_products]` in `load_products`
+        self.num_rows = len(self.asins) if num_products is None else \
+            int(np.searchsorted(column('source_idx'), num_products))
+        self._decode = lru_cache(maxsize=cache_size)(self._decode_row)
+        self.path = path
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self._decode(i) for i in range(*row.indices(self.num_rows))]
+        if row < 0:
+            row += self.num_rows
+        if not 0 <= row < self.num_rows:
+            raise IndexError('catalog index out of range')
+        return self._decode(row)
+
+    def _decode_row(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return pickle.loads(self.records[start:end].tobytes())
+
+    def row_of(self, asin):
+        """Row of `asin` by binary search over the sorted ASIN column, or None"""
+        key = asin.encode() if isinstance(asin, str) else asin
+        if len(key) > ASIN_WIDTH:
+            return None
+        lo, hi = 0, len(self.asin_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.asins[self.asin_order[mid]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.asin_order):
+            row = int(self.asin_order[lo])
+            if self.asins[row] == key and row < self.num_rows:
+                return row
+        return None
+
+    def goal_products(self):
+        """
+        The products `get_goals` builds goals from, in catalog order, with
+        only the fields it reads
+        """
+        with open(os.path.join(self.path, 'goal_products.pkl'), 'rb') as f:
+            goal_products = pickle.load(f)
+        return [product for row, product in goal_products if row < self.num_rows]
+
+    def field(self, row, name):
+        """Interned string field of a product without decoding its record"""
+        return self.strings[self.interned[name][row]]
+
+    def rows_with(self, name, value):
+        """Rows whose interned field `name` equals `value`, in catalog order"""
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            return []
+        rows = np.flatnonzero(self.interned[name][:self.num_rows] == string_id)
+        return rows.tolist()
+
+
+class ProductItemView(Mapping):
+    """`product_item_dict` over a catalog: asin -> product dict"""
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __getitem__(self, asin):
+        row = self.catalog.row_of(asin)
+        if row is None:
+            raise KeyError(asin)
+        return self.catalog[row]
+
+    def __contains__(self, asin):
+        return self.catalog.row_of(asin) is not None
+
+    def __iter__(self):
+        return (self.catalog.asins[row].decode() for row in range(len(self.catalog)))
+
+    def __len__(self):
+        return len(self.catalog)
+
+
+class ProductPriceView(Mapping):
+    """
+    `product_prices` over a catalog. Like `generate_product_prices`, a product
+    with a price range gets a uniformly sampled price, drawn the first time it
+    is looked up and fixed from then on.
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.prices = {}
+
+    def __getitem__(self, asin):
+        if asin not in self.prices:
+            row = self.catalog.row_of(asin)
+            if row is None:
+                raise KeyError(asin)
+            low, high = self.catalog.pricing[row]
+            self.prices[asin] = float(low) if np.isnan(high) else random.uniform(low, high)
+        return self.prices[asin]
+
+    def get(self, asin, default=None):
+        try:
+            return self[asin]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(ProductItemView(self.catalog))
+
+    def __len__(self):
+        return len(self.catalog)
+
+
+class AttributeAsinsView(Mapping):
+    """`attribute_to_asins` over a catalog; unknown attributes map to an empty set"""
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __getitem__(self, attribute):
+        i = self.catalog.attributes.get(attribute)
+        if i is None:
+            return set()
+        start, end = int(self.catalog.attr_offsets[i]), int(self.catalog.attr_offsets[i + 1])
+        return {
+            self.catalog.asins[row].decode()
+            for row in self.catalog.attr_rows[start:end]
+            if row < len(self.catalog)
+        }
+
+    def __iter__(self):
+        return iter(self.catalog.attributes)
+
+    def __len__(self):
+        return len(self.catalog.attributes)
+
+
+def load_catalog(path, num_products=None, human_goals=True):
+    """Memory-map a catalog; returns the same tuple as `load_products`"""
+    catalog = ProductCatalog(path, num_products=num_products)
+    if catalog.meta['human_goals'] != bool(human_goals):
+        raise ValueError(
+            f'Catalog {path} was built with human_goals={catalog.meta["human_goals"]}; '
+            f'rebuild it to load with human_goals={bool(human_goals)}.'
+        )
+    print(f'Catalog of {len(catalog)} products mapped.')
+    return (
+        catalog,
+        ProductItemView(catalog),
+        ProductPriceView(catalog),
+        AttributeAsinsView(catalog),
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a memory-mapped WebShop product catalog')
+    parser.add_argument('items_path', help='items file, e.g. data/items_shuffle.json')
+    parser.add_argument('out_dir', help='directory to write the catalog to')
+    parser.add_argument('--synthetic_goals', action='store_true',
+                        help='store synthetic instead of human instructions')
+    args = parser.parse_args()
+    build_catalog(args.items_path, args.out_dir, human_goals=not args.synthetic_goals)
@@ -7,14 +7,16 @@ import random
 from collections import defaultdict
 from ast import literal_eval
 from decimal import Decimal
+from functools import lru_cache
 
 import cleantext
 from tqdm import tqdm
 from rank_bm25 import BM25Okapi
-from flask import render_template_string
+from flask import current_app
 from rich import print
 from pyserini.search.lucene import LuceneSearcher
 
+from web_agent_site.engine.catalog import ProductCatalog, is_catalog, load_catalog
 from web_agent_site.utils import (
     BASE_DIR,
     DEFAULT_FILE_PATH,
@@ -28,6 +30,7 @@ TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
 SEARCH_RETURN_N = 50
 PRODUCT_WINDOW = 10
 TOP_K_ATTR = 10
+SEARCH_CACHE_SIZE = 4096
 
 END_BUTTON = 'Buy Now'
 NEXT_PAGE = 'Next >'
@@ -45,15 +48,15 @@ def map_action_to_html(action, **kwargs):
     action_name, action_arg = parse_action(action)
     if action_name == 'start':
         path = os.path.join(TEMPLATE_DIR, 'search_page.html')
-        html = render_template_string(
-            read_html_template(path=path),
+        html = render_html_template(
+            path,
             session_id=kwargs['session_id'],
             instruction_text=kwargs['instruction_text'],
         )
     elif action_name == 'search':
         path = os.path.join(TEMPLATE_DIR, 'results_page.html')
-        html = render_template_string(
-            read_html_template(path=path),
+        html = render_html_template(
+            path,
             session_id=kwargs['session_id'],
             products=kwargs['products'],
             keywords=kwargs['keywords'],
@@ -63,8 +66,8 @@ def map_action_to_html(action, **kwargs):
         )
     elif action_name == 'click' and action_arg == END_BUTTON:
         path = os.path.join(TEMPLATE_DIR, 'done_page.html')
-        html = render_template_string(
-            read_html_template(path),
+        html = render_html_template(
+            path,
             session_id=kwargs['session_id'],
             reward=kwargs['reward'],
             asin=kwargs['asin'],
@@ -80,8 +83,8 @@ def map_action_to_html(action, **kwargs):
         )
     elif action_name == 'click' and action_arg in ACTION_TO_TEMPLATE:
         path = os.path.join(TEMPLATE_DIR, ACTION_TO_TEMPLATE[action_arg])
-        html = render_template_string(
-            read_html_template(path),
+        html = render_html_template(
+            path,
             session_id=kwargs['session_id'],
             product_info=kwargs['product_info'],
             keywords=kwargs['keywords'],
@@ -92,8 +95,8 @@ def map_action_to_html(action, **kwargs):
         )
     elif action_name == 'click':
         path = os.path.join(TEMPLATE_DIR, 'item_page.html')
-        html = render_template_string(
-            read_html_template(path),
+        html = render_html_template(
+            path,
             session_id=kwargs['session_id'],
             product_info=kwargs['product_info'],
             keywords=kwargs['keywords'],
@@ -108,12 +111,26 @@ def map_action_to_html(action, **kwargs):
     return html
 
 
+@lru_cache(maxsize=None)
 def read_html_template(path):
     with open(path) as f:
         template = f.read()
     return template
 
 
+def render_html_template(path, **context):
+    """
+    Equivalent to `render_template_string(read_html_template(path), **context)`,
+    but each template is compiled once per Flask app instead of on every render
+    """
+    app = current_app._get_current_object()
+    templates = app.extensions.setdefault('webshop_templates', {})
+    if path not in templates:
+        templates[path] = app.jinja_env.from_string(read_html_template(path))
+    app.update_template_context(context)
+    return templates[path].render(context)
+
+
 def parse_action(action):
     """
     Parse action string to action name and its arguments.
@@ -154,6 +171,16 @@ def get_top_n_product_from_keywords(
     ):
     if keywords[0] == '<r>':
         top_n_products = random.sample(all_products, k=SEARCH_RETURN_N)
+    elif isinstance(all_products, ProductCatalog) and keywords[0] in ('<a>', '<c>', '<q>'):
+        # Answer scans from the catalog columns instead of decoding every product
+        if keywords[0] == '<a>':
+            asins = attribute_to_asins[' '.join(keywords[1:]).strip()]
+            rows = sorted(all_products.row_of(asin) for asin in asins)
+        elif keywords[0] == '<c>':
+            rows = all_products.rows_with('category', keywords[1].strip())
+        else:
+            rows = all_products.rows_with('query', ' '.join(keywords[1:]).strip())
+        top_n_products = [all_products[row] for row in rows]
     elif keywords[0] == '<a>':
         attribute = ' '.join(keywords[1:]).strip()
         asins = attribute_to_asins[attribute]
@@ -165,14 +192,20 @@ def get_top_n_product_from_keywords(
         query = ' '.join(keywords[1:]).strip()
         top_n_products = [p for p in all_products if p['query'] == query]
     else:
-        keywords = ' '.join(keywords)
-        hits = search_engine.search(keywords, k=SEARCH_RETURN_N)
-        docs = [search_engine.doc(hit.docid) for hit in hits]
-        top_n_asins = [json.loads(doc.raw())['id'] for doc in docs]
+        top_n_asins = search_asins(search_engine, ' '.join(keywords))
         top_n_products = [product_item_dict[asin] for asin in top_n_asins if asin in product_item_dict]
     return top_n_products
 
 
+@lru_cache(maxsize=SEARCH_CACHE_SIZE)
+def search_asins(search_engine, keywords):
+    """Top ASINs for `keywords`, memoized since rollouts repeat the same searches"""
+    hits = search_engine.search(keywords, k=SEARCH_RETURN_N)
+    # Documents are indexed with their ASIN as id (see search_engine/), so the
+    # raw JSON document never needs to be fetched and parsed
+    return tuple(hit.docid for hit in hits)
+
+
 def get_product_per_page(top_n_products, page):
     return top_n_products[(page - 1) * PRODUCT_WINDOW:page * PRODUCT_WINDOW]
 
@@ -228,7 +261,9 @@ def clean_product_keys(products):
 
 
 def load_products(filepath, num_products=None, human_goals=True):
-    # TODO: move to preprocessing step -> enforce single source of truth
+    if is_catalog(filepath):
+        # Preprocessed catalog, see `web_agent_site.engine.catalog`
+        return load_catalog(filepath, num_products=num_products, human_goals=human_goals)
     with open(filepath) as f:
         products = json.load(f)
     print('Products loaded.')
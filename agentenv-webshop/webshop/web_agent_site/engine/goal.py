@@ -5,15 +5,22 @@ import itertools
 import random
 import spacy
 from collections import defaultdict
+from functools import lru_cache
 from rich import print
 from thefuzz import fuzz
+from web_agent_site.engine.catalog import ProductCatalog
 from web_agent_site.engine.normalize import normalize_color
 
 nlp = spacy.load("en_core_web_lg")
 
 PRICE_RANGE = [10.0 * i for i in range(1, 100)]
+REWARD_CACHE_SIZE = 65536
+TYPE_POS = ('PNOUN', 'NOUN', 'PROPN')
 
 def get_goals(all_products, product_prices, human_goals=True):
+    if isinstance(all_products, ProductCatalog):
+        # Read the goal fields stored apart instead of decoding every product
+        all_products = all_products.goal_products()
     if human_goals:
         return get_human_goals(all_products, product_prices)
     else:
@@ -138,6 +145,40 @@ def get_synthetic_goals(all_products, product_prices):
     return goals
 
 
+def _nouns(doc):
+    return tuple(t.text.lower() for t in doc if t.pos_ in TYPE_POS)
+
+
+# name -> lowercased nouns; bounded by the number of product and goal names
+_type_nouns = {}
+
+
+def get_type_nouns(name):
+    """Lowercased nouns of a product or goal name, parsed once per name"""
+    nouns = _type_nouns.get(name)
+    if nouns is None:
+        nouns = _type_nouns[name] = _nouns(nlp(name))
+    return nouns
+
+
+def precompute_type_nouns(names, batch_size=256):
+    """Parse all not yet seen `names` in batched `nlp.pipe` passes"""
+    names = [name for name in dict.fromkeys(names) if name not in _type_nouns]
+    for name, doc in zip(names, nlp.pipe(names, batch_size=batch_size)):
+        _type_nouns[name] = _nouns(doc)
+
+
+@lru_cache(maxsize=REWARD_CACHE_SIZE)
+def is_fuzzy_match(a, b):
+    """`fuzz.token_set_ratio` above the 85 threshold used by the reward, memoized per pair"""
+    return fuzz.token_set_ratio(a, b) > 85
+
+
+@lru_cache(maxsize=REWARD_CACHE_SIZE)
+def _lowered_product_text(title, bullet_points, description):
+    return title.lower(), ' '.join(bullet_points).lower(), description.lower()
+
+
 def get_type_reward(purchased_product, goal):
     """Determines the type reward - captures whether chosen product is in the same category"""
     query_match = purchased_product['query'] == goal['query']
@@ -151,11 +192,8 @@ def get_type_reward(purchased_product, goal):
     purchased_type = purchased_product['name']
     desired_type = goal['name']
 
-    purchased_type_parse = nlp(purchased_type)
-    desired_type_parse = nlp(desired_type)
-
-    purchased_type_parse = [t.text.lower() for t in purchased_type_parse if t.pos_ in ('PNOUN', 'NOUN', 'PROPN')]
-    desired_type_parse = [t.text.lower() for t in desired_type_parse if t.pos_ in ('PNOUN', 'NOUN', 'PROPN')]
+    purchased_type_parse = get_type_nouns(purchased_type)
+    desired_type_parse = get_type_nouns(desired_type)
 
     n_intersect_type = len(
         set(purchased_type_parse) & set(desired_type_parse)
@@ -191,25 +229,24 @@ def get_attribute_reward(purchased_product, goal):
     purchased_attrs = purchased_product['Attributes']
     goal_attrs = goal['attributes']
 
+    bullet_points = purchased_product['BulletPoints']
+    product_texts = _lowered_product_text(
+        purchased_product['Title'],
+        tuple(bullet_points) if isinstance(bullet_points, list) else bullet_points,
+        purchased_product['Description'],
+    )
+
     num_attr_matches = 0
     for g_attr in goal_attrs:
         matched = False
         # Check whether goal attribute found in purchased product attribute list
         for p_attr in purchased_attrs:
-            score = fuzz.token_set_ratio(p_attr, g_attr)
-            if score > 85:
+            if is_fuzzy_match(p_attr, g_attr):
                 num_attr_matches += 1
                 matched = True
                 break
         # If not in purchased attrs, check Title, Bullet Points (Features), Desc
-        if (
-            not matched and
-            (
-                g_attr in purchased_product['Title'].lower() or
-                g_attr in ' '.join(purchased_product['BulletPoints']).lower() or
-                g_attr in purchased_product['Description'].lower()
-            )
-        ):
+        if not matched and any(g_attr in text for text in product_texts):
             num_attr_matches += 1
             matched = True
     
@@ -226,8 +263,7 @@ def get_option_reward(purchased_options, goal_options):
     num_option_matches = 0
     for g_option in goal_options:
         for p_option in purchased_options:
-            score = fuzz.token_set_ratio(p_option, g_option)
-            if score > 85:
+            if is_fuzzy_match(p_option, g_option):
                 num_option_matches += 1
                 break
     
@@ -278,3 +314,22 @@ def get_reward(purchased_product, goal, price, options, **kwargs):
             info['w_price'] = 1 / (len(goal['attributes']) + len(goal['goal_options']) + 1)
         return total_reward, info
     return total_reward
+
+
+def get_rewards(purchases, **kwargs):
+    """
+    Batch version of `get_reward` for re-scoring many purchases at once.
+
+    Arguments:
+    purchases -- iterable of (purchased_product, goal, price, options) tuples
+    """
+    purchases = list(purchases)
+    precompute_type_nouns(
+        name
+        for purchased_product, goal, _, _ in purchases
+        for name in (purchased_product['name'], goal['name'])
+    )
+    return [
+        get_reward(purchased_product, goal, price, options, **kwargs)
+        for purchased_product, goal, price, options in purchases
+    ]
@@ -1,7 +1,10 @@
 import gym
+import itertools
 import json
 import random
+import re
 import string
+import threading
 import time
 import torch
 
@@ -9,6 +12,7 @@ from bs4 import BeautifulSoup
 from bs4.element import Comment
 from collections import defaultdict
 from flask import Flask
+from functools import lru_cache
 from web_agent_site.engine.engine import (
     load_products,
     init_search_engine,
@@ -28,6 +32,41 @@ from web_agent_site.utils import (
 )
 
 app = Flask(__name__)
+
+PAGE_CACHE_SIZE = 4096
+# Item pages are rendered once with this placeholder and the session id is
+# substituted afterwards, which is exact for ids that need no URL/HTML escaping
+SESSION_ID_PLACEHOLDER = 'WEBSHOPSESSIONIDPLACEHOLDER'
+CACHEABLE_SESSION_ID = re.compile(r'[A-Za-z0-9_.-]+')
+
+# Process-wide SimServers keyed by their constructor arguments, see `get_shared_server`
+_shared_servers = {}
+_shared_servers_lock = threading.Lock()
+_shared_server_env_ids = itertools.count()
+
+
+def get_shared_server(
+    base_url,
+    file_path,
+    filter_goals=None,
+    limit_goals=-1,
+    num_products=None,
+    human_goals=0,
+    show_attrs=False,
+):
+    """
+    Return the SimServer built for these arguments in this process, creating it on first use.
+
+    The product catalog, search engine and goals are loaded once and shared read-only by every
+    env that asks for the same arguments; only the per-session state in `user_sessions` differs.
+    """
+    key = (base_url, file_path, filter_goals, limit_goals, num_products, human_goals, show_attrs)
+    with _shared_servers_lock:
+        if key not in _shared_servers:
+            _shared_servers[key] = SimServer(*key)
+        return _shared_servers[key]
+
+
 class WebAgentTextEnv(gym.Env):
     """Gym environment for Text mode of WebShop environment"""
     def __init__(
@@ -50,6 +89,8 @@ class WebAgentTextEnv(gym.Env):
         session
         session_prefix
         show_attrs
+        shared_server (`bool`) -- If true and no `server` is given, reuse the process-wide
+            SimServer for these arguments instead of loading a new one (default False)
         """
         super(WebAgentTextEnv, self).__init__()
         self.observation_mode = observation_mode
@@ -58,7 +99,8 @@ class WebAgentTextEnv(gym.Env):
         self.file_path = file_path
 
         self.base_url = 'http://127.0.0.1:3000'
-        self.server = SimServer(
+        self.shared_server = server is None and self.kwargs.get('shared_server', False)
+        server_args = (
             self.base_url,
             self.file_path,
             self.kwargs.get('filter_goals'),
@@ -66,17 +108,31 @@ class WebAgentTextEnv(gym.Env):
             self.kwargs.get('num_products'),
             self.kwargs.get('human_goals'),
             self.kwargs.get('show_attrs', False),
-        ) if server is None else server
+        )
+        if server is not None:
+            self.server = server
+        elif self.shared_server:
+            self.server = get_shared_server(*server_args)
+        else:
+            self.server = SimServer(*server_args)
         self.browser = SimBrowser(self.server)
 
         self.session = self.kwargs.get('session')
         self.session_prefix = self.kwargs.get('session_prefix')
+        if self.shared_server:
+            # Namespace session ids so envs sharing a server never see each other's sessions
+            self.session_prefix = (
+                f'env{next(_shared_server_env_ids)}_{self.session_prefix or ""}'
+            )
         if self.kwargs.get('get_image', 0):
             self.feats = torch.load(FEAT_CONV)
             self.ids = torch.load(FEAT_IDS)
             self.ids = {url: idx for idx, url in enumerate(self.ids)}
         self.prev_obs = []
         self.prev_actions = []
+        # (html, parsed html) and (html, simple text) of the last page seen
+        self._parsed_html = None
+        self._simple_text = None
         self.num_prev_obs = self.kwargs.get('num_prev_obs', 0)
         self.num_prev_actions = self.kwargs.get('num_prev_actions', 0)
         self.reset()
@@ -173,8 +229,11 @@ class WebAgentTextEnv(gym.Env):
         """
         if html is None:
             html = self.state['html']
-        html_obj = BeautifulSoup(html, 'html.parser')
-        return html_obj
+        # Actions, observation and instruction are all read from the same page,
+        # so parse each page once
+        if self._parsed_html is None or self._parsed_html[0] != html:
+            self._parsed_html = (html, BeautifulSoup(html, 'html.parser'))
+        return self._parsed_html[1]
     
     @property
     def observation(self):
@@ -207,11 +266,15 @@ class WebAgentTextEnv(gym.Env):
     
     def convert_html_to_text(self, html, simple=False):
         """Strip HTML of tags and add separators to convert observation into simple mode"""
+        if simple and self._simple_text is not None and self._simple_text[0] == html:
+            return self._simple_text[1]
         texts = self._parse_html(html).findAll(text=True)
         visible_texts = filter(tag_visible, texts)
         if simple:
             # For `simple` mode, return just [SEP] separators
-            return ' [SEP] '.join(t.strip() for t in visible_texts if t != '\n')
+            observation = ' [SEP] '.join(t.strip() for t in visible_texts if t != '\n')
+            self._simple_text = (html, observation)
+            return observation
         else:
             # Otherwise, return an observation with tags mapped to specific, unique separators
             observation = ''
@@ -237,6 +300,7 @@ class WebAgentTextEnv(gym.Env):
     
     def reset(self, session=None, instruction_text=None):
         """Create a new session and reset environment variables"""
+        prev_session = self.session
         session_int = None
         if session is not None:
             self.session = str(session)
@@ -246,6 +310,9 @@ class WebAgentTextEnv(gym.Env):
             self.session = ''.join(random.choices(string.ascii_lowercase, k=10))
         if self.session_prefix is not None:
             self.session = self.session_prefix + self.session
+        if self.shared_server and prev_session != self.session:
+            # The shared server outlives this env, so drop the session it no longer uses
+            self.server.user_sessions.pop(prev_session, None)
 
         init_url = f'{self.base_url}/{self.session}'
         self.browser.get(init_url, session_id=self.session, session_int=session_int)
@@ -261,7 +328,8 @@ class WebAgentTextEnv(gym.Env):
         pass
 
     def close(self):
-        pass
+        if self.shared_server:
+            self.server.user_sessions.pop(self.session, None)
     
 
 def tag_visible(element):
@@ -338,6 +406,7 @@ class SimServer:
         self.render_time = 0
         self.sample_time = 0
         self.assigned_instruction_text = None  # TODO: very hacky, should remove
+        self._render_product_page = lru_cache(maxsize=PAGE_CACHE_SIZE)(self._render_product_page_uncached)
         
     @app.route('/', methods=['GET', 'POST'])
     def index(self, session_id, **kwargs):
@@ -416,7 +485,6 @@ class SimServer:
             session["actions"]["options"] += 1
 
         # Set fields + url of page, then render page's HTML
-        product_info = self.product_item_dict[session["asin"]]
         keywords_url_string = '+'.join(session["keywords"])
         option_string = json.dumps(session['options'])
 
@@ -426,16 +494,14 @@ class SimServer:
             f'{session["page"]}/{option_string}'
         )
 
-        html = map_action_to_html(
+        html = self.render_product_page(
             'click',
             session_id=session_id,
-            product_info=product_info,
             keywords=session["keywords"],
             page=session["page"],
             asin=session["asin"],
             options=session["options"],
             instruction_text=session["goal"]["instruction_text"],
-            show_attrs=self.show_attrs,
         )
         return html, url
 
@@ -450,7 +516,6 @@ class SimServer:
                 break
         
         # Set fields + url of page, then render page's HTML
-        product_info = self.product_item_dict[session["asin"]]
         session["actions"][clickable_name] += 1
         keywords_url_string = '+'.join(session["keywords"])
         url = (
@@ -458,10 +523,9 @@ class SimServer:
             f'{session["asin"]}/{keywords_url_string}/{session["page"]}/'
             f'{clickable_name}/{session["options"]}'
         )
-        html = map_action_to_html(
+        html = self.render_product_page(
             f'click[{clickable_name}]',
             session_id=session_id,
-            product_info=product_info,
             keywords=session["keywords"],
             page=session["page"],
             asin=session["asin"],
@@ -506,6 +570,32 @@ class SimServer:
         )
         return html, url, reward
     
+    def render_product_page(self, action, session_id, keywords, page, asin, options, instruction_text):
+        """Render an item page or item sub page, memoized on (action, asin, keywords, page, options)"""
+        if not CACHEABLE_SESSION_ID.fullmatch(session_id):
+            return self._render_product_page_uncached(
+                action, session_id, tuple(keywords), page, asin,
+                tuple(options.items()), instruction_text,
+            )
+        html = self._render_product_page(
+            action, SESSION_ID_PLACEHOLDER, tuple(keywords), page, asin,
+            tuple(options.items()), instruction_text,
+        )
+        return html.replace(SESSION_ID_PLACEHOLDER, session_id)
+
+    def _render_product_page_uncached(self, action, session_id, keywords, page, asin, options, instruction_text):
+        return map_action_to_html(
+            action,
+            session_id=session_id,
+            product_info=self.product_item_dict[asin],
+            keywords=list(keywords),
+            page=page,
+            asin=asin,
+            options=dict(options),
+            instruction_text=instruction_text,
+            show_attrs=self.show_attrs,
+        )
+
     def receive(self, session_id, current_url, session_int=None, **kwargs):
         """Map action to the corresponding page"""
         status = dict(reward=0.0, done=False)
@@ -7,7 +7,8 @@ from .agent import (
     Llama2Template,
     Llama3Template,
 )
-from .env import BaseEnvClient, StepOutput
+from .env import BaseEnvClient, BaseHttpEnvClient, StepOutput
+from .http_client import AsyncEnvHttpSession, EnvHttpSession, HttpCallStats
 from .task import BaseTask
 from .types import ActionFormat, ActionWithTought, ConversationMessage
 from .utils import (
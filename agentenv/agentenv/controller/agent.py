@@ -3,7 +3,9 @@ import math
 import os
 import random
 import shutil
+import threading
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from pathlib import Path
 
 import torch
@@ -24,6 +26,13 @@ except ImportError:
 
 
 class BaseChatTemplate(metaclass=ABCMeta):
+    # Max number of tokenized messages kept by `tokenize_conversation`. Only
+    # the first `cached_prefix_length` messages of a conversation are cached:
+    # every episode of a task starts with the same `conversation_start`, so
+    # those are encoded once, while later messages rarely repeat. Set to 0 to
+    # disable caching.
+    tokenization_cache_size: int = 256
+
     @abstractmethod
     def tokenize_conversation_one(
         self,
@@ -34,25 +43,73 @@ class BaseChatTemplate(metaclass=ABCMeta):
     ) -> TokenizedConversationOutput:
         raise NotImplementedError
 
+    def _tokenize_conversation_one_cached(
+        self,
+        message: ConversationMessage,
+        tokenizer: PreTrainedTokenizerBase,
+        idx: int,
+        add_generation_prompt: bool = False,
+    ) -> TokenizedConversationOutput:
+        if self.tokenization_cache_size <= 0:
+            return self.tokenize_conversation_one(
+                message, tokenizer, idx, add_generation_prompt
+            )
+        cache = self.__dict__.get("_tokenization_cache")
+        if cache is None:
+            cache = self.__dict__.setdefault("_tokenization_cache", OrderedDict())
+
+        # the tokenizer object itself is part of the key, so a cache entry can
+        # never be served to a different tokenizer
+        key = (
+            tokenizer,
+            message["from"],
+            message["loss"],
+            message["value"],
+            idx,
+            add_generation_prompt,
+        )
+        try:
+            res = cache[key]
+            cache.move_to_end(key)
+            return res
+        except KeyError:
+            pass
+        res = self.tokenize_conversation_one(
+            message, tokenizer, idx, add_generation_prompt
+        )
+        cache[key] = res
+        while len(cache) > self.tokenization_cache_size:
+            try:
+                cache.popitem(last=False)
+            except KeyError:
+                break
+        return res
+
     def tokenize_conversation(
         self,
         conversation: list[ConversationMessage],
         tokenizer: PreTrainedTokenizerBase,
         add_generation_prompt: bool = False,
+        cached_prefix_length: int = 0,
     ) -> TokenizedConversationOutput:
-        text = ""
+        texts = []
         input_ids = []
         action_mask = []
         for idx, message in enumerate(conversation):
-            res = self.tokenize_conversation_one(
+            tokenize_one = (
+                self._tokenize_conversation_one_cached
+                if idx < cached_prefix_length
+                else self.tokenize_conversation_one
+            )
+            res = tokenize_one(
                 message, tokenizer, idx, add_generation_prompt and idx == len(conversation) - 1
             )
-            text += res["text"]
-            input_ids += res["input_ids"]
-            action_mask += res["action_mask"]
+            texts.append(res["text"])
+            input_ids.extend(res["input_ids"])
+            action_mask.extend(res["action_mask"])
         return TokenizedConversationOutput(
             {
-                "text": text,
+                "text": "".join(texts),
                 "input_ids": input_ids,
                 "action_mask": action_mask,
             }
@@ -72,11 +129,61 @@ class Agent:
         self.chat_template = chat_template or Llama2Template()
         self.inference_engine = InferenceEngine(inference_engine)
         self._vllm = None
+        # rollout workers of a multi-client task share one agent, so the model
+        # and the vLLM engine are driven by one caller at a time
+        self._generate_lock = threading.Lock()
 
-    @torch.no_grad()
     def generate(
         self,
-        input_ids: list[int],
+        input_ids: list[list[int]],
+        generation_config: GenerationConfig,
+        refresh_engine: bool = False,
+    ) -> torch.Tensor:
+        with self._generate_lock:
+            return self._generate(input_ids, generation_config, refresh_engine)
+
+    def _get_vllm_model(self) -> torch.nn.Module | None:
+        """
+        Return the model module of the live vLLM engine, or None if the engine
+        runs its workers in other processes (e.g. with tensor parallelism or
+        the V1 engine).
+        """
+        executor = getattr(self._vllm.llm_engine, "model_executor", None)
+        worker = getattr(executor, "driver_worker", None)
+        worker = getattr(worker, "worker", worker)  # unwrap WorkerWrapperBase
+        model_runner = getattr(worker, "model_runner", None)
+        return getattr(model_runner, "model", None)
+
+    @torch.no_grad()
+    def _sync_vllm_weights(self, model: PreTrainedModel) -> bool:
+        """
+        Push the current weights of `model` into the live vLLM engine without
+        serialising them or rebuilding the engine. Return False if the engine
+        does not expose its model in this process, or caches prefixes and
+        cannot drop them.
+        """
+        engine = self._vllm.llm_engine
+        # cached prefixes hold KV computed with the old weights
+        prefix_caching = getattr(
+            getattr(engine, "cache_config", None), "enable_prefix_caching", True
+        )
+        if prefix_caching and not hasattr(engine, "reset_prefix_cache"):
+            return False
+        vllm_model = self._get_vllm_model()
+        if vllm_model is None:
+            return False
+        print("Syncing weights into vLLM engine.")
+        # state_dict() returns views on the parameters, so nothing is copied
+        # to host memory before vLLM loads each tensor into its own buffers
+        vllm_model.load_weights(model.state_dict().items())
+        if prefix_caching:
+            engine.reset_prefix_cache()
+        return True
+
+    @torch.no_grad()
+    def _generate(
+        self,
+        input_ids: list[list[int]],
         generation_config: GenerationConfig,
         refresh_engine: bool = False,
     ) -> torch.Tensor:
@@ -88,7 +195,9 @@ class Agent:
             os.environ["VLLM_WORKER_MULTIPROC_METHOD"] = "spawn"
             from vllm import LLM, SamplingParams, TokensPrompt
 
-            if not refresh_engine and self._vllm is not None:
+            if self._vllm is not None and (
+                not refresh_engine or self._sync_vllm_weights(model)
+            ):
                 llm = self._vllm
             else:
                 print("Initializing vLLM engine.")
@@ -142,14 +251,7 @@ class Agent:
                 shutil.rmtree(shm_path)
 
             INF = float("inf")
-            max_tokens = generation_config.max_new_tokens or INF
-            if generation_config.max_length:
-                max_length = generation_config.max_length - len(input_ids)
-            else:
-                max_length = INF
-            max_tokens = min(max_tokens, max_length)
-            if max_tokens == INF:
-                max_tokens = None
+            max_new_tokens = generation_config.max_new_tokens or INF
 
             generation_config = {
                 "repetition_penalty": generation_config.repetition_penalty,
@@ -159,18 +261,31 @@ class Agent:
                 "min_p": generation_config.min_p,
                 # "length_penalty": generation_config.length_penalty,
                 "early_stopping": generation_config.early_stopping,
-                "max_tokens": max_tokens,
+                "max_length": generation_config.max_length,
                 "min_new_tokens": generation_config.min_new_tokens,
                 "stop_token_ids": [self.tokenizer.eos_token_id],
             }
             generation_config = {k: v for k, v in generation_config.items() if v}
+            max_length = generation_config.pop("max_length", None)
+
+            # prompts of a batch differ in length, so the token budget is per prompt
+            sampling_params = []
+            for prompt in input_ids:
+                if max_length:
+                    max_tokens = min(max_new_tokens, max_length - len(prompt))
+                else:
+                    max_tokens = max_new_tokens
+                sampling_params.append(
+                    SamplingParams.from_optional(
+                        **generation_config,
+                        max_tokens=None if max_tokens == INF else max_tokens,
+                        detokenize=False,
+                    )
+                )
             output = llm.generate(
                 # prompts=TokensPrompt(prompt_token_ids=input_ids),
                 prompt_token_ids=input_ids,
-                sampling_params=SamplingParams.from_optional(
-                    **generation_config,
-                    detokenize=False,
-                ),
+                sampling_params=sampling_params,
                 use_tqdm=False,
             )
 
@@ -180,15 +295,33 @@ class Agent:
                 generated_tokens.append(list(o.outputs[0].token_ids))
 
         else:
+            # left pad the batch so that every prompt ends where generation starts
+            max_input_length = max(len(prompt) for prompt in input_ids)
+            pad_token_id = (
+                self.tokenizer.pad_token_id
+                if self.tokenizer.pad_token_id is not None
+                else self.tokenizer.eos_token_id
+            )
+            padded_input_ids = []
+            attention_mask = []
+            for prompt in input_ids:
+                n_pad = max_input_length - len(prompt)
+                padded_input_ids.append([pad_token_id] * n_pad + list(prompt))
+                attention_mask.append([0] * n_pad + [1] * len(prompt))
             output = model.generate(
-                inputs=torch.tensor(input_ids, device=model.device),
+                inputs=torch.tensor(padded_input_ids, device=model.device),
+                attention_mask=torch.tensor(attention_mask, device=model.device),
                 generation_config=generation_config,
             )
             if isinstance(output, GenerateOutput):
                 output = output.sequences
-            generated_tokens = [
-                o[len(input_ids[0]) :].cpu().numpy().tolist() for o in output
-            ]
+            generated_tokens = []
+            for o in output:
+                tokens = o[max_input_length:].cpu().numpy().tolist()
+                # finished sequences are padded until the longest one stops
+                if self.tokenizer.eos_token_id in tokens:
+                    tokens = tokens[: tokens.index(self.tokenizer.eos_token_id) + 1]
+                generated_tokens.append(tokens)
 
         return generated_tokens
 
@@ -1,5 +1,9 @@
 from abc import ABCMeta, abstractmethod
+from typing import Any, Optional
 
+from requests.exceptions import RequestException
+
+from .http_client import AsyncEnvHttpSession, EnvHttpSession
 from .types import ActionFormat, ConversationMessage, StepOutput
 
 
@@ -32,3 +36,68 @@ class BaseEnvClient(metaclass=ABCMeta):
         """
         Reset the environment.
         """
+
+
+class BaseHttpEnvClient(BaseEnvClient):
+    """
+    Env client talking to an env server over HTTP. All clients of the same
+    server in one process share a pooled keep-alive `EnvHttpSession`.
+    """
+
+    # name of the request field that carries the env id
+    env_id_key: str = "env_idx"
+
+    def __init__(
+        self,
+        env_server_base: str,
+        data_len: int,
+        *args,
+        timeout: int = 300,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.env_server_base = env_server_base
+        self.timeout = timeout
+        self.data_len = data_len
+        self.session = EnvHttpSession.get_shared(env_server_base)
+        self.env_id = None
+
+    def __len__(self) -> int:
+        return self.data_len
+
+    def _create(self, data: Optional[dict[str, Any]] = None) -> Any:
+        # a duplicate create only leaves an unused env behind
+        res = self.session.post(
+            "create", json=data, idempotent=True, timeout=self.timeout
+        )
+        if res.status_code != 200:
+            raise RequestException(f"Failed to create environment: {res}")
+        return res.json()
+
+    def _post(self, path: str, data: dict[str, Any]) -> Any:
+        data[self.env_id_key] = self.env_id
+        res = self.session.post(path, json=data, timeout=self.timeout)
+        assert res.status_code == 200
+        return res.json()
+
+    def _get(self, path: str) -> Any:
+        res = self.session.get(
+            path, params={self.env_id_key: self.env_id}, timeout=self.timeout
+        )
+        assert res.status_code == 200
+        return res.json()
+
+    async def _apost(self, path: str, data: dict[str, Any]) -> Any:
+        data[self.env_id_key] = self.env_id
+        session = AsyncEnvHttpSession.get_shared(self.env_server_base)
+        res = await session.post(path, json=data, timeout=self.timeout)
+        assert res.status_code == 200
+        return res.json()
+
+    async def _aget(self, path: str) -> Any:
+        session = AsyncEnvHttpSession.get_shared(self.env_server_base)
+        res = await session.get(
+            path, params={self.env_id_key: self.env_id}, timeout=self.timeout
+        )
+        assert res.status_code == 200
+        return res.json()
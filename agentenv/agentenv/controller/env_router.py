@@ -0,0 +1,299 @@
+"""
+Spread the envs of one env server over several worker processes.
+
+Env servers keep their envs in a module-level object, so a request that lands
+on another uvicorn worker than the one that created its env fails. The router
+starts `num_workers` copies of an env server command, each on its own port,
+and forwards every request to the worker that owns its env. The worker is
+encoded in the env id the router hands out, `local_id * num_workers + worker`,
+so clients need no changes. Requires the `router` extra.
+
+    python -m agentenv.controller.env_router --workers 8 --port 36001 \\
+        -- webshop --host 127.0.0.1 --port {port}
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import subprocess
+import time
+from typing import Any, Optional, Sequence
+
+try:
+    import httpx
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, Response
+    from starlette.routing import Route
+except ImportError:
+    httpx = None
+
+# keys that carry the env id in request bodies and query strings, by priority;
+# some servers use `id` for the data item when `env_idx` is also present
+ENV_ID_KEYS = ("env_idx", "id")
+HTTP_METHODS = ["GET", "POST", "PUT", "DELETE", "PATCH"]
+
+
+def encode_env_id(local_id: int, worker: int, num_workers: int) -> int:
+    return local_id * num_workers + worker
+
+
+def decode_env_id(env_id: int, num_workers: int) -> tuple[int, int]:
+    """Worker and worker-local id of a routed env id"""
+    local_id, worker = divmod(env_id, num_workers)
+    return worker, local_id
+
+
+def _is_endpoint(path: str, name: str) -> bool:
+    return path.rstrip("/").rsplit("/", 1)[-1] == name
+
+
+class EnvRouter:
+    """
+    Supervises the worker processes of one env server and routes requests.
+
+    `command` is the worker command line, in which `{port}` is replaced with
+    the port of each worker. Workers that exit are restarted; their envs are
+    lost and requests for them fail with the worker's error.
+    """
+
+    def __init__(
+        self,
+        command: Sequence[str],
+        num_workers: int,
+        base_port: int,
+        worker_host: str = "127.0.0.1",
+        startup_timeout: float = 600.0,
+    ) -> None:
+        if httpx is None:
+            raise ImportError(
+                "EnvRouter requires httpx, starlette and uvicorn. "
+                "Install them with `pip install agentenv[router]`."
+            )
+        if not any("{port}" in arg for arg in command):
+            raise ValueError("The worker command must contain a `{port}` placeholder.")
+        self.command = list(command)
+        self.num_workers = num_workers
+        self.ports = [base_port + i for i in range(num_workers)]
+        self.worker_host = worker_host
+        self.startup_timeout = startup_timeout
+        self.processes: list[Optional[subprocess.Popen]] = [None] * num_workers
+        self.in_flight = [0] * num_workers
+        self.created = [0] * num_workers
+        self.restarts = [0] * num_workers
+        self._next_worker = itertools.cycle(range(num_workers))
+        self._stopping = False
+        self.client = None
+
+    def _url(self, worker: int, path: str) -> str:
+        return f"http://{self.worker_host}:{self.ports[worker]}{path}"
+
+    def _spawn(self, worker: int) -> None:
+        args = [arg.replace("{port}", str(self.ports[worker])) for arg in self.command]
+        self.processes[worker] = subprocess.Popen(args)
+
+    async def _wait_ready(self, worker: int) -> None:
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self.processes[worker].poll() is not None:
+                raise RuntimeError(
+                    f"Env worker {worker} exited with code {self.processes[worker].returncode}."
+                )
+            try:
+                await self.client.get(self._url(worker, "/"))
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Env worker {worker} did not start in time.")
+                await asyncio.sleep(0.5)
+
+    async def start(self) -> None:
+        self.client = httpx.AsyncClient(timeout=None)
+        for worker in range(self.num_workers):
+            self._spawn(worker)
+        await asyncio.gather(*(self._wait_ready(w) for w in range(self.num_workers)))
+        print(f"Started {self.num_workers} env workers on ports {self.ports}.")
+
+    async def watch(self, interval: float = 1.0) -> None:
+        while not self._stopping:
+            for worker, process in enumerate(self.processes):
+                if process is not None and process.poll() is not None and not self._stopping:
+                    print(
+                        f"Env worker {worker} exited with code {process.returncode}, restarting."
+                    )
+                    self.restarts[worker] += 1
+                    self._spawn(worker)
+            await asyncio.sleep(interval)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        self._stopping = True
+        for process in self.processes:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            if process is None:
+                continue
+            try:
+                await asyncio.to_thread(process.wait, timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.client is not None:
+            await self.client.aclose()
+
+    def _route(self, params: dict[str, str], payload: Any) -> tuple[Optional[int], dict, Any]:
+        """Find the env id of a request and rewrite it to the worker-local id"""
+        if isinstance(payload, dict):
+            for key in ENV_ID_KEYS:
+                if isinstance(payload.get(key), int):
+                    worker, local_id = decode_env_id(payload[key], self.num_workers)
+                    return worker, params, {**payload, key: local_id}
+        for key in ENV_ID_KEYS:
+            if key in params:
+                try:
+                    env_id = int(params[key])
+                except ValueError:
+                    break
+                worker, local_id = decode_env_id(env_id, self.num_workers)
+                return worker, {**params, key: str(local_id)}, payload
+        return None, params, payload
+
+    def _encode_created(self, result: Any, worker: int) -> Any:
+        if isinstance(result, int):
+            return encode_env_id(result, worker, self.num_workers)
+        if isinstance(result, dict):
+            for key in ENV_ID_KEYS:
+                if isinstance(result.get(key), int):
+                    return {**result, key: encode_env_id(result[key], worker, self.num_workers)}
+        return result
+
+    async def _forward(
+        self, request: "Request", worker: int, params: dict, content: bytes
+    ) -> "httpx.Response":
+        headers = {}
+        if "content-type" in request.headers:
+            headers["content-type"] = request.headers["content-type"]
+        self.in_flight[worker] += 1
+        try:
+            return await self.client.request(
+                request.method,
+                self._url(worker, request.url.path),
+                params=params,
+                content=content,
+                headers=headers,
+            )
+        finally:
+            self.in_flight[worker] -= 1
+
+    async def list_envs(self, request: "Request") -> "Response":
+        responses = await asyncio.gather(
+            *(
+                self._forward(request, w, dict(request.query_params), b"")
+                for w in range(self.num_workers)
+            )
+        )
+        env_ids = []
+        for worker, res in enumerate(responses):
+            if res.status_code != 200:
+                return Response(res.content, res.status_code, media_type="application/json")
+            env_ids.extend(
+                encode_env_id(i, worker, self.num_workers) for i in res.json()
+            )
+        return JSONResponse(env_ids)
+
+    def stats(self, request: "Request") -> "Response":
+        return JSONResponse(
+            {
+                "ports": self.ports,
+                "in_flight": self.in_flight,
+                "created": self.created,
+                "restarts": self.restarts,
+            }
+        )
+
+    async def handle(self, request: "Request") -> "Response":
+        path = request.url.path
+        if _is_endpoint(path, "list_envs"):
+            return await self.list_envs(request)
+
+        content = await request.body()
+        try:
+            payload = json.loads(content) if content else None
+        except ValueError:
+            payload = None
+        params = dict(request.query_params)
+
+        is_create = _is_endpoint(path, "create")
+        worker = None
+        if not is_create:
+            worker, params, routed_payload = self._route(params, payload)
+            if routed_payload is not payload:
+                content = json.dumps(routed_payload).encode()
+        if worker is None:
+            worker = (
+                next(self._next_worker)
+                if is_create
+                else min(range(self.num_workers), key=self.in_flight.__getitem__)
+            )
+
+        res = await self._forward(request, worker, params, content)
+        if is_create and res.status_code == 200:
+            self.created[worker] += 1
+            return JSONResponse(self._encode_created(res.json(), worker))
+        return Response(
+            res.content, res.status_code, media_type=res.headers.get("content-type")
+        )
+
+    def app(self) -> "Starlette":
+        @contextlib.asynccontextmanager
+        async def lifespan(app):
+            await self.start()
+            watcher = asyncio.create_task(self.watch())
+            try:
+                yield
+            finally:
+                watcher.cancel()
+                await self.stop()
+
+        return Starlette(
+            routes=[
+                Route("/router_stats", self.stats, methods=["GET"]),
+                Route("/{path:path}", self.handle, methods=HTTP_METHODS),
+            ],
+            lifespan=lifespan,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Route the envs of one env server over several worker processes",
+        usage="%(prog)s [options] -- COMMAND (with a {port} placeholder)",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--base_port", type=int, default=None, help="port of the first worker, default port + 1"
+    )
+    parser.add_argument("--worker_host", type=str, default="127.0.0.1")
+    parser.add_argument("--startup_timeout", type=float, default=600.0)
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("missing worker command")
+    router = EnvRouter(
+        command,
+        num_workers=args.workers,
+        base_port=args.base_port or args.port + 1,
+        worker_host=args.worker_host,
+        startup_timeout=args.startup_timeout,
+    )
+    uvicorn.run(router.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
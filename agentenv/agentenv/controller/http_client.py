@@ -0,0 +1,271 @@
+import asyncio
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# status codes an env server returns while it is busy or restarting
+RETRY_STATUS_CODES = (502, 503, 504)
+# a 502 or 504 may come after the server applied the request, so requests that
+# must not run twice, like POST /step, are only retried on 503
+NON_IDEMPOTENT_RETRY_STATUS_CODES = (503,)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _is_idempotent(method: str, idempotent: Optional[bool]) -> bool:
+    return method.upper() in IDEMPOTENT_METHODS if idempotent is None else idempotent
+
+
+def _retry_status_codes(idempotent: bool) -> tuple[int, ...]:
+    return RETRY_STATUS_CODES if idempotent else NON_IDEMPOTENT_RETRY_STATUS_CODES
+
+
+def _connection_not_established(exc: requests.ConnectionError) -> bool:
+    """Whether `exc` was raised before the request reached the server"""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+@dataclass
+class HttpCallStats:
+    calls: int = 0
+    retries: int = 0
+    failures: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.calls if self.calls else 0.0
+
+    def record(self, seconds: float, retries: int, failed: bool) -> None:
+        self.calls += 1
+        self.retries += retries
+        self.failures += int(failed)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class _EnvHttpSessionBase:
+    def __init__(
+        self,
+        env_server_base: str,
+        max_retries: int = 5,
+        backoff_factor: float = 0.1,
+        max_backoff: float = 5.0,
+    ) -> None:
+        self.env_server_base = env_server_base.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.stats: dict[str, HttpCallStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def _url(self, path: str) -> str:
+        return f"{self.env_server_base}/{path.lstrip('/')}"
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.backoff_factor * 2**attempt, self.max_backoff)
+
+    def _record(self, path: str, start: float, retries: int, failed: bool) -> None:
+        with self._stats_lock:
+            self.stats.setdefault(path, HttpCallStats()).record(
+                time.perf_counter() - start, retries, failed
+            )
+
+    def stats_summary(self) -> dict[str, dict[str, float]]:
+        """
+        Per-path call count, retries, failures and latency in seconds.
+        """
+        with self._stats_lock:
+            return {
+                path: {
+                    "calls": s.calls,
+                    "retries": s.retries,
+                    "failures": s.failures,
+                    "mean_seconds": s.mean_seconds,
+                    "max_seconds": s.max_seconds,
+                }
+                for path, s in self.stats.items()
+            }
+
+
+class EnvHttpSession(_EnvHttpSessionBase):
+    """
+    Keep-alive connection pool to one env server. Busy responses and dropped
+    connections are retried with exponential backoff, and the latency of every
+    call is recorded per path in `stats`.
+
+    Requests are idempotent if their method is, or if `idempotent=True` is
+    passed. Others are only retried when the connection could not be
+    established or on 503, so that the server never applies them twice.
+
+    Use `EnvHttpSession.get_shared` so that all env clients of the same server
+    in this process share one pool.
+    """
+
+    _shared: dict[str, "EnvHttpSession"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        env_server_base: str,
+        pool_size: int = 64,
+        max_retries: int = 5,
+        backoff_factor: float = 0.1,
+        max_backoff: float = 5.0,
+    ) -> None:
+        super().__init__(env_server_base, max_retries, backoff_factor, max_backoff)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def get_shared(cls, env_server_base: str) -> "EnvHttpSession":
+        with cls._shared_lock:
+            if env_server_base not in cls._shared:
+                cls._shared[env_server_base] = cls(env_server_base)
+            return cls._shared[env_server_base]
+
+    def request(
+        self, method: str, path: str, idempotent: Optional[bool] = None, **kwargs
+    ) -> requests.Response:
+        idempotent = _is_idempotent(method, idempotent)
+        retry_status_codes = _retry_status_codes(idempotent)
+        start = time.perf_counter()
+        retries = 0
+        while True:
+            try:
+                res = self.session.request(method, self._url(path), **kwargs)
+            except requests.ConnectionError as e:
+                if retries >= self.max_retries or not (
+                    idempotent or _connection_not_established(e)
+                ):
+                    self._record(path, start, retries, failed=True)
+                    raise
+            else:
+                if (
+                    res.status_code not in retry_status_codes
+                    or retries >= self.max_retries
+                ):
+                    self._record(path, start, retries, failed=res.status_code != 200)
+                    return res
+            time.sleep(self._backoff(retries))
+            retries += 1
+
+    def post(
+        self, path: str, json: Any = None, idempotent: bool = False, **kwargs
+    ) -> requests.Response:
+        return self.request("POST", path, idempotent=idempotent, json=json, **kwargs)
+
+    def get(
+        self, path: str, params: Optional[Mapping[str, Any]] = None, **kwargs
+    ) -> requests.Response:
+        return self.request("GET", path, params=params, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncEnvHttpSession(_EnvHttpSessionBase):
+    """
+    `httpx.AsyncClient` counterpart of `EnvHttpSession`. Requires `httpx`.
+
+    `post_many` sends a batch of requests concurrently over the same pool.
+    Use `AsyncEnvHttpSession.get_shared` to share one pool per server and
+    event loop.
+    """
+
+    _shared: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, AsyncEnvHttpSession]]" = (
+        weakref.WeakKeyDictionary()
+    )
+
+    def __init__(
+        self,
+        env_server_base: str,
+        pool_size: int = 64,
+        max_retries: int = 5,
+        backoff_factor: float = 0.1,
+        max_backoff: float = 5.0,
+    ) -> None:
+        if httpx is None:
+            raise ImportError(
+                "AsyncEnvHttpSession requires httpx. Install it with `pip install httpx`."
+            )
+        super().__init__(env_server_base, max_retries, backoff_factor, max_backoff)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+        )
+
+    @classmethod
+    def get_shared(cls, env_server_base: str) -> "AsyncEnvHttpSession":
+        # an httpx client is bound to the event loop it was first used in
+        sessions = cls._shared.setdefault(asyncio.get_running_loop(), {})
+        if env_server_base not in sessions:
+            sessions[env_server_base] = cls(env_server_base)
+        return sessions[env_server_base]
+
+    async def request(
+        self, method: str, path: str, idempotent: Optional[bool] = None, **kwargs
+    ) -> "httpx.Response":
+        idempotent = _is_idempotent(method, idempotent)
+        retry_status_codes = _retry_status_codes(idempotent)
+        start = time.perf_counter()
+        retries = 0
+        while True:
+            try:
+                res = await self.client.request(method, self._url(path), **kwargs)
+            except httpx.TransportError as e:
+                # errors raised before the request was sent
+                not_sent = isinstance(
+                    e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+                )
+                if retries >= self.max_retries or not (idempotent or not_sent):
+                    self._record(path, start, retries, failed=True)
+                    raise
+            else:
+                if (
+                    res.status_code not in retry_status_codes
+                    or retries >= self.max_retries
+                ):
+                    self._record(path, start, retries, failed=res.status_code != 200)
+                    return res
+            await asyncio.sleep(self._backoff(retries))
+            retries += 1
+
+    async def post(
+        self, path: str, json: Any = None, idempotent: bool = False, **kwargs
+    ) -> "httpx.Response":
+        return await self.request(
+            "POST", path, idempotent=idempotent, json=json, **kwargs
+        )
+
+    async def get(
+        self, path: str, params: Optional[Mapping[str, Any]] = None, **kwargs
+    ) -> "httpx.Response":
+        return await self.request("GET", path, params=params, **kwargs)
+
+    async def post_many(
+        self, path: str, payloads: Sequence[Any], **kwargs
+    ) -> list["httpx.Response"]:
+        return await asyncio.gather(
+            *(self.post(path, json=payload, **kwargs) for payload in payloads)
+        )
+
+    async def close(self) -> None:
+        await self.client.aclose()
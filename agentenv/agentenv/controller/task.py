@@ -1,3 +1,6 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 from typing import Any, Callable, Mapping, Optional, Sequence
 
 from transformers import GenerationConfig
@@ -20,7 +23,7 @@ class BaseTask:
 
         Args:
             client_args (Mapping[str, Any]): A mapping of client arguments.
-            n_clients (int, optional): The number of clients. Defaults to 1. Larger than 1 for batch generation. Batch generation is not implemented yet.
+            n_clients (int, optional): The number of clients. Defaults to 1. Larger than 1 for concurrent rollouts, where each client runs one episode at a time. With a local `Agent`, the waiting episodes are answered by one batched generate call per round; with an `APIAgent`, episodes run in parallel threads.
         """
         if self.env_client_cls is None or self.env_name is None:
             raise NotImplementedError
@@ -46,7 +49,10 @@ class BaseTask:
                 ConversationMessage({"from": "human", "loss": None, "value": state})
             )
             conversation_tokenized = agent.chat_template.tokenize_conversation(
-                conversation, tokenizer, add_generation_prompt=True
+                conversation,
+                tokenizer,
+                add_generation_prompt=True,
+                cached_prefix_length=len(client.conversation_start),
             )
         elif isinstance(agent, APIAgent):
             conversation = [APIConversationMessage({"role": "user", "content": client.conversation_start[0]["value"], "reasoning_content": None}),
@@ -147,6 +153,147 @@ class BaseTask:
         else:
             raise NotImplementedError
 
+    def _generate_experience_lockstep(
+        self,
+        agent: Agent,
+        idxs: Sequence[int],
+        generation_config: Optional[GenerationConfig] = None,
+        max_rounds: Optional[int] = None,
+    ) -> list[ExperienceOutput]:
+        """
+        Keep one episode alive per client and advance all of them in lock step:
+        every episode waiting on the model is answered by a single batched
+        `Agent.generate` call, then the env steps are dispatched concurrently.
+        Finished episodes drop out and their clients are refilled with the
+        remaining idxs.
+        """
+        tokenizer = agent.tokenizer
+        max_length = generation_config.max_length or 4096
+        pending = deque(enumerate(idxs))
+        idle_clients = deque(self.clients)
+        result: list[Optional[ExperienceOutput]] = [None] * len(idxs)
+        active = []
+
+        def reset_client(client: BaseEnvClient, idx: int) -> str:
+            client.reset(idx)
+            return client.observe()
+
+        def finish(episode: dict) -> None:
+            tokenized = episode["conversation_tokenized"]
+            result[episode["position"]] = ExperienceOutput(
+                conversation=episode["conversation"],
+                reward=episode["reward"],
+                text=tokenized["text"],
+                seq_ids=tokenized["input_ids"],
+                attention_mask=[1] * len(tokenized["input_ids"]),
+                action_mask=tokenized["action_mask"],
+            )
+            idle_clients.append(episode["client"])
+
+        with ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
+            while pending or active:
+                # refill idle clients with new episodes
+                starting = []
+                while pending and idle_clients:
+                    position, idx = pending.popleft()
+                    client = idle_clients.popleft()
+                    starting.append(
+                        (position, client, executor.submit(reset_client, client, idx))
+                    )
+                for position, client, future in starting:
+                    conversation = list(client.conversation_start)
+                    conversation.append(
+                        ConversationMessage(
+                            {"from": "human", "loss": None, "value": future.result()}
+                        )
+                    )
+                    active.append(
+                        {
+                            "position": position,
+                            "client": client,
+                            "conversation": conversation,
+                            "conversation_tokenized": agent.chat_template.tokenize_conversation(
+                                conversation,
+                                tokenizer,
+                                add_generation_prompt=True,
+                                cached_prefix_length=len(client.conversation_start),
+                            ),
+                            "reward": 0.0,
+                            "rounds": 0,
+                        }
+                    )
+
+                # if input_length exceeds max_length, the episode is over
+                waiting = []
+                for episode in active:
+                    if len(episode["conversation_tokenized"]["input_ids"]) >= max_length:
+                        finish(episode)
+                    else:
+                        waiting.append(episode)
+                active = []
+                if not waiting:
+                    continue
+
+                try:
+                    batch_generated_tokens = agent.generate(
+                        [e["conversation_tokenized"]["input_ids"] for e in waiting],
+                        generation_config,
+                    )
+                except Exception as e:  # pylint: disable=W0718:broad-exception-caught
+                    print(e)
+                    for episode in waiting:
+                        finish(episode)  # finish if generate method raises exceptions
+                    continue
+
+                stepping = []
+                for episode, generated_tokens in zip(waiting, batch_generated_tokens):
+                    if generated_tokens[-1] != tokenizer.eos_token_id:
+                        generated_tokens += [tokenizer.eos_token_id]
+
+                    generated_text = tokenizer.decode(generated_tokens)
+                    tokenized = episode["conversation_tokenized"]
+                    tokenized["text"] += f" {generated_text}"
+                    tokenized["input_ids"] += generated_tokens
+                    tokenized["action_mask"] += [1] * len(generated_tokens)
+
+                    generated_text = generated_text[
+                        : -len(tokenizer.eos_token)
+                    ]  # not endswith eos_token
+                    episode["conversation"].append(
+                        ConversationMessage(
+                            {"from": "gpt", "loss": True, "value": generated_text}
+                        )
+                    )
+                    stepping.append(
+                        (episode, executor.submit(episode["client"].step, generated_text))
+                    )
+
+                for episode, future in stepping:
+                    step_output = future.result()
+                    episode["reward"] = step_output.reward
+
+                    env_message = ConversationMessage(
+                        {"from": "human", "loss": None, "value": step_output.state}
+                    )
+                    env_message_tokenized = agent.chat_template.tokenize_conversation_one(
+                        env_message, tokenizer, add_generation_prompt=True
+                    )
+                    tokenized = episode["conversation_tokenized"]
+                    episode["conversation"].append(env_message)
+                    tokenized["text"] += env_message_tokenized["text"]
+                    tokenized["input_ids"] += env_message_tokenized["input_ids"]
+                    tokenized["action_mask"] += env_message_tokenized["action_mask"]
+
+                    episode["rounds"] += 1
+                    if step_output.done or (
+                        max_rounds is not None and episode["rounds"] >= max_rounds
+                    ):
+                        finish(episode)
+                    else:
+                        active.append(episode)
+
+        return result
+
     def _generate_experience_batch(
         self,
         agent: Agent | APIAgent,
@@ -154,17 +301,48 @@ class BaseTask:
         generation_config: Optional[GenerationConfig] = None,
         max_rounds: Optional[int] = None,
     ) -> list[ExperienceOutput]:
-        client = self.clients[0]
-        result = [
-            self._generate_experience_one(
+        if len(self.clients) == 1 or len(idxs) <= 1:
+            client = self.clients[0]
+            return [
+                self._generate_experience_one(
+                    agent=agent,
+                    client=client,
+                    idx=idx,
+                    generation_config=generation_config,
+                    max_rounds=max_rounds,
+                )
+                for idx in idxs
+            ]
+
+        if isinstance(agent, Agent):
+            return self._generate_experience_lockstep(
                 agent=agent,
-                client=client,
-                idx=idx,
+                idxs=idxs,
                 generation_config=generation_config,
                 max_rounds=max_rounds,
             )
-            for idx in idxs
-        ]
+
+        # every worker leases an idle client, so an env server session is never
+        # shared by two episodes at the same time
+        idle_clients = Queue()
+        for client in self.clients:
+            idle_clients.put(client)
+
+        def run_one(idx: int) -> ExperienceOutput:
+            client = idle_clients.get()
+            try:
+                return self._generate_experience_one(
+                    agent=agent,
+                    client=client,
+                    idx=idx,
+                    generation_config=generation_config,
+                    max_rounds=max_rounds,
+                )
+            finally:
+                idle_clients.put(client)
+
+        with ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
+            result = list(executor.map(run_one, idxs))
         return result
 
     def generate_experience(
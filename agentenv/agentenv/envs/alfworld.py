@@ -2,12 +2,9 @@ import json
 from typing import Any, Mapping
 import re
 
-import requests
-from requests.exceptions import RequestException
-
 from agentenv.controller import (
     BaseAdapter,
-    BaseEnvClient,
+    BaseHttpEnvClient,
     BaseTask,
     extract_python_code_blocks,
     format_code_as_action_prompt,
@@ -21,7 +18,7 @@ from agentenv.controller.types import (
     StepOutput,
 )
 
-from agentenv.controller import BaseEnvClient, BaseTask
+from agentenv.controller import BaseHttpEnvClient, BaseTask
 from agentenv.controller.types import ConversationMessage, StepOutput
 
 
@@ -512,7 +509,8 @@ class AlfWorldAdapter(BaseAdapter):
         
 
 
-class AlfWorldEnvClient(BaseEnvClient):
+class AlfWorldEnvClient(BaseHttpEnvClient):
+    env_id_key = "id"
     adapter_cls = AlfWorldAdapter
     
     def __init__(
@@ -523,45 +521,17 @@ class AlfWorldEnvClient(BaseEnvClient):
         timeout: int = 300,
         **kwargs,
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
 
-        ok = requests.post(f"{self.env_server_base}/create", timeout=self.timeout)
-        if ok.status_code != 200:
-            raise requests.RequestException(f"Failed to create environment: {ok}")
+        ok = self._create()
         
         self.conversation_start = self.adapter_cls.conversation_start_dict[
             self.action_format
         ]
-        
-        ok = ok.json()
         # print(ok)
         self.env_id = ok["id"]
         self.info = None
 
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: dict[str, Any]) -> dict[str, Any]:
-        data["id"] = self.env_id
-        res = requests.post(
-            f"{self.env_server_base}/{path}",
-            json=data,
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?id={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
     def observe(self) -> str:
         return f"{self.info['observation']}\nAVAILABLE ACTIONS: {','.join(self.info['available_actions'])}"
 
@@ -1,12 +1,11 @@
 from typing import Any, Mapping
-import requests
 import re
-from requests.exceptions import RequestException
-from agentenv.controller import BaseEnvClient, BaseTask
+from agentenv.controller import BaseHttpEnvClient, BaseTask
 from agentenv.controller.types import ConversationMessage, StepOutput
 
 
-class BabyAIEnvClient(BaseEnvClient):
+class BabyAIEnvClient(BaseHttpEnvClient):
+    env_id_key = "id"
     conversation_start = (
         ConversationMessage(
             {
@@ -27,39 +26,11 @@ class BabyAIEnvClient(BaseEnvClient):
     def __init__(
         self, env_server_base: str, data_len: int, *args, timeout: int = 300, **kwargs
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
 
-        ok = requests.post(f"{self.env_server_base}/create", timeout=self.timeout)
-        if ok.status_code != 200:
-            raise RequestException(f"Failed to create environment: {ok}")
-
-        ok = ok.json()
+        ok = self._create()
         self.env_id = ok["id"]
 
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: dict[str, Any]) -> dict[str, Any]:
-        data["id"] = self.env_id
-        res = requests.post(
-            f"{self.env_server_base}/{path}",
-            json=data,
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?id={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
     def observe(self) -> str:
         return self.info["observation"]
 
@@ -1,10 +1,7 @@
 import json
 from typing import Any, Mapping
 
-import requests
-from requests.exceptions import RequestException
-
-from agentenv.controller import BaseEnvClient, BaseTask
+from agentenv.controller import BaseHttpEnvClient, BaseTask
 from agentenv.controller.types import ConversationMessage, StepOutput
 
 
@@ -14,7 +11,8 @@ from agentenv.controller.types import ConversationMessage, StepOutput
 # ----------------------------------------
 
 
-class MazeEnvClient(BaseEnvClient):
+class MazeEnvClient(BaseHttpEnvClient):
+    env_id_key = "id"
     conversation_start = (
         ConversationMessage(
             {"from": "human", "loss": None, "value": "You are an expert maze solver."}
@@ -120,16 +118,9 @@ Now let's start a new game. Return your action and your thought in the format ab
         timeout: int = 300,
         **kwargs,
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
-
-        ok = requests.post(f"{self.env_server_base}/create", timeout=self.timeout)
-        if ok.status_code != 200:
-            raise RequestException(f"Failed to create environment: {ok}")
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
 
-        ok = ok.json()
+        ok = self._create()
         print(ok)
         self.env_id = ok["id"]
         self.info = {
@@ -137,27 +128,6 @@ Now let's start a new game. Return your action and your thought in the format ab
             "done": False,
         }
         
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: dict[str, Any]) -> dict[str, Any]:
-        data["id"] = self.env_id
-        res = requests.post(
-            f"{self.env_server_base}/{path}",
-            json=data,
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?id={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
     def observe(self) -> str:
         return self.info["observation"]
 
@@ -218,7 +188,8 @@ class MazeTask(BaseTask):
 # ----------------------------------------
 
 
-class WordleEnvClient(BaseEnvClient):
+class WordleEnvClient(BaseHttpEnvClient):
+    env_id_key = "id"
     conversation_start = (
         ConversationMessage(
             {"from": "human", "loss": None, "value": "You are an expert wordle player."}
@@ -271,16 +242,9 @@ Now let's start a new game. Remember, the word you guess should be strictly in t
         timeout: int = 300,
         **kwargs,
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
 
-        ok = requests.post(f"{self.env_server_base}/create", timeout=self.timeout)
-        if ok.status_code != 200:
-            raise RequestException(f"Failed to create environment: {ok}")
-
-        ok = ok.json()
+        ok = self._create()
         print(ok)
         self.env_id = ok["id"]
         vocab = self._get("filtered_vocab")
@@ -294,27 +258,6 @@ Now let's start a new game. Remember, the word you guess should be strictly in t
         }
         print(self.info["observation"])
 
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: dict[str, Any]) -> dict[str, Any]:
-        data["id"] = self.env_id
-        res = requests.post(
-            f"{self.env_server_base}/{path}",
-            json=data,
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?id={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
     def observe(self) -> str:
         return self.info["observation"]
 
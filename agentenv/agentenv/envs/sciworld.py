@@ -2,12 +2,9 @@ import json
 import re
 from typing import Any, Mapping
 
-import requests
-from requests.exceptions import RequestException
-
 from agentenv.controller import (
     BaseAdapter,
-    BaseEnvClient,
+    BaseHttpEnvClient,
     BaseTask,
     extract_python_code_blocks,
     format_code_as_action_prompt,
@@ -790,47 +787,21 @@ class SciWorldAdapter(BaseAdapter):
         text += "\n```"
         return text
 
-class SciworldEnvClient(BaseEnvClient):
+class SciworldEnvClient(BaseHttpEnvClient):
+    env_id_key = "id"
     adapter_cls = SciWorldAdapter
 
     def __init__(
         self, env_server_base: str, data_len: int, *args, timeout: int = 300, **kwargs
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
-
-        ok = requests.post(f"{self.env_server_base}/create", timeout=self.timeout)
-        if ok.status_code != 200:
-            raise RequestException(f"Failed to create environment: {ok}")
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
+
+        ok = self._create()
         self.conversation_start = self.adapter_cls.conversation_start_dict[
             self.action_format
         ]
-        ok = ok.json()
         self.env_id = ok["id"]
 
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: dict[str, Any]) -> dict[str, Any]:
-        data["id"] = self.env_id
-        res = requests.post(
-            f"{self.env_server_base}/{path}",
-            json=data,
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?id={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
     def observe(self) -> str:
         return self.info["observation"]
 
@@ -1,11 +1,9 @@
 from typing import Any, Mapping, Dict, List, Optional
 
-import requests
-from requests.exceptions import RequestException
-from agentenv.controller import BaseEnvClient, BaseTask
+from agentenv.controller import BaseHttpEnvClient, BaseTask
 from agentenv.controller.types import ConversationMessage, StepOutput
 
-class SearchQAEnvClient(BaseEnvClient):
+class SearchQAEnvClient(BaseHttpEnvClient):
     conversation_start = (
             ConversationMessage(
                 {
@@ -20,43 +18,11 @@ class SearchQAEnvClient(BaseEnvClient):
     def __init__(
         self, env_server_base: str, data_len: int, *args, timeout: int = 300, **kwargs
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
         self.id = 0
         data = dict()
         data['id'] = 0
-        ok = requests.post(
-            f"{self.env_server_base}/create",
-            json=data,
-            timeout=self.timeout,
-        )
-        if ok.status_code != 200:
-            raise RequestException(f"Failed to create environment: {ok}")
-
-        self.env_id = ok.json()
-
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        data["env_idx"] = self.env_id
-        res = requests.post(
-            f"{self.env_server_base}/{path}",
-            json=data,
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> Dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?env_idx={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
+        self.env_id = self._create(data)
 
     def observe(self) -> Dict[str, Any]:
         question = self._get("observation")
@@ -1,13 +1,10 @@
 from typing import Any, Mapping
 
-import requests
-from requests.exceptions import RequestException
-
-from agentenv.controller import BaseEnvClient, BaseTask
+from agentenv.controller import BaseHttpEnvClient, BaseTask
 from agentenv.controller.types import ConversationMessage, StepOutput
 
 
-class SqlGymEnvClient(BaseEnvClient):
+class SqlGymEnvClient(BaseHttpEnvClient):
     conversation_start = (
         ConversationMessage(
             {
@@ -22,52 +19,9 @@ class SqlGymEnvClient(BaseEnvClient):
     def __init__(
         self, env_server_base: str, data_len: int, *args, timeout: int = 300, **kwargs
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
-
-        ok = requests.post(
-            f"{self.env_server_base}/create",
-            timeout=self.timeout,
-        )
-        if ok.status_code != 200:
-            raise RequestException(f"Failed to create environment: {ok}")
-
-        self.env_id = ok.json()
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
 
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: dict[str, Any]) -> dict[str, Any]:
-        data["env_idx"] = self.env_id
-        max_retries = 5
-        for _ in range(max_retries):
-            res = requests.post(
-                f"{self.env_server_base}/{path}",
-                json=data,
-                timeout=self.timeout,
-            )
-            if res.status_code == 503:
-                import time
-
-                time.sleep(0.1)
-            elif res.status_code == 200:
-                break
-            else:
-                print("---------------------")
-                print(res.status_code)
-                print(data)
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?env_idx={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
+        self.env_id = self._create()
 
     def step(self, action: str) -> StepOutput:
         action = action.split("```sql")[-1].split("```")[0].strip()
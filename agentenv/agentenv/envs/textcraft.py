@@ -2,14 +2,12 @@ from typing import Any, Mapping
 
 import re
 
-import requests
-from requests.exceptions import RequestException
-
-from agentenv.controller import BaseEnvClient, BaseTask
+from agentenv.controller import BaseHttpEnvClient, BaseTask
 from agentenv.controller.types import ConversationMessage, StepOutput
 
 
-class TextCraftEnvClient(BaseEnvClient):
+class TextCraftEnvClient(BaseHttpEnvClient):
+    env_id_key = "id"
     conversation_start = (
         ConversationMessage(
             {
@@ -38,19 +36,10 @@ class TextCraftEnvClient(BaseEnvClient):
         goal: str = None,
         **kwargs,
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
 
         dir_info = {"minecraft_dir": minecraft_dir, "commands": commands, "goal": goal}
-        ok = requests.post(
-            f"{self.env_server_base}/create", timeout=self.timeout, json=dir_info
-        )
-        if ok.status_code != 200:
-            raise RequestException(f"Failed to create environment: {ok}")
-
-        ok = ok.json()
+        ok = self._create(dir_info)
         self.env_id = ok["id"]
         self.info = {
             "observation": ok["observation"],
@@ -58,27 +47,6 @@ class TextCraftEnvClient(BaseEnvClient):
             "done": False,
         }
 
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: dict[str, Any]) -> dict[str, Any]:
-        data["id"] = self.env_id
-        res = requests.post(
-            f"{self.env_server_base}/{path}",
-            json=data,
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?id={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
-
     def observe(self) -> str:
         return self.info["observation"]
 
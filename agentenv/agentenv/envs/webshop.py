@@ -1,11 +1,9 @@
 import json
 from typing import Any, Mapping
 
-import requests
-
 from agentenv.controller import (
     BaseAdapter,
-    BaseEnvClient,
+    BaseHttpEnvClient,
     BaseTask,
     extract_python_code_blocks,
     format_code_as_action_prompt,
@@ -147,60 +145,19 @@ class WebshopAdapter(BaseAdapter):
         return text
 
 
-class WebshopEnvClient(BaseEnvClient):
+class WebshopEnvClient(BaseHttpEnvClient):
     adapter_cls = WebshopAdapter
 
     def __init__(
         self, env_server_base: str, data_len: int, *args, timeout: int = 300, **kwargs
     ):
-        super().__init__(*args, **kwargs)
-        self.env_server_base = env_server_base
-        self.timeout = timeout
-        self.data_len = data_len
-
-        ok = requests.post(
-            f"{self.env_server_base}/create",
-            timeout=self.timeout,
-        )
-        if ok.status_code != 200:
-            raise requests.RequestException(f"Failed to create environment: {ok}")
+        super().__init__(env_server_base, data_len, *args, timeout=timeout, **kwargs)
+
+        ok = self._create()
         self.conversation_start = self.adapter_cls.conversation_start_dict[
             self.action_format
         ]
-        self.env_id = ok.json()
-
-    def __len__(self):
-        return self.data_len
-
-    def _post(self, path: str, data: dict[str, Any]) -> dict[str, Any]:
-        data["env_idx"] = self.env_id
-        max_retries = 5
-        for attempt in range(max_retries):
-            res = requests.post(
-                f"{self.env_server_base}/{path}",
-                json=data,
-                timeout=self.timeout,
-            )
-            if res.status_code == 503:
-                import time
-
-                time.sleep(0.1)
-            elif res.status_code == 200:
-                break
-            else:
-                print("---------------------")
-                print(res.status_code)
-                print(data)
-        assert res.status_code == 200
-        return res.json()
-
-    def _get(self, path: str) -> dict[str, Any]:
-        res = requests.get(
-            f"{self.env_server_base}/{path}?env_idx={self.env_id}",
-            timeout=self.timeout,
-        )
-        assert res.status_code == 200
-        return res.json()
+        self.env_id = ok
 
     def observe(self) -> dict[str, Any]:
         response = self._get("observation")
@@ -1,4 +1,3 @@
-import json
 import os
 from collections import defaultdict
 from dataclasses import asdict
@@ -6,17 +5,24 @@ from datetime import timedelta
 from functools import partial
 from typing import Sequence
 
-import jsonlines
 import numpy as np
 import torch
 import wandb
 from accelerate import Accelerator, InitProcessGroupKwargs
-from accelerate.utils import broadcast, gather_object
+from accelerate.utils import broadcast
 from agentenv.controller import Agent
 from agentenv.controller.agent import Agent
 from agentenv.controller.task import BaseTask
 from agentenv.controller.utils import BaseTrainer
-from agentenv.trainer.utils import set_seed
+from agentenv.trainer.trajectory_writer import (
+    TrajectoryShardWriter,
+    merge_trajectory_shards,
+)
+from agentenv.trainer.utils import (
+    get_train_dataloader,
+    load_or_tokenize_dataset,
+    set_seed,
+)
 from datasets import Dataset, DatasetDict
 from torch.utils.data import DataLoader
 from tqdm import tqdm
@@ -82,15 +88,9 @@ class BCTrainer(BaseTrainer):
         with self.accelerator.main_process_first():
             self.raw_dataset = DatasetDict(
                 {
-                    "train": Dataset.from_list(
-                        json.load(open(self.args["train_file"], "r"))
-                    ),
-                    "inference": Dataset.from_list(
-                        json.load(open(self.args["inference_file"], "r"))
-                    ),
-                    "test": Dataset.from_list(
-                        json.load(open(self.args["test_file"], "r"))
-                    ),
+                    "train": Dataset.from_json(self.args["train_file"]),
+                    "inference": Dataset.from_json(self.args["inference_file"]),
+                    "test": Dataset.from_json(self.args["test_file"]),
                 }
             )
             self.accelerator.print("Raw data:", self.raw_dataset)
@@ -149,21 +149,25 @@ class BCTrainer(BaseTrainer):
 
             return new_batch
 
-        tokenized_dataset = DatasetDict(
-            {
-                "train": self.raw_dataset["train"].map(
-                    tokenize_fn,
-                    fn_kwargs={
-                        "args": self.args,
-                        "tokenizer": self.agent.tokenizer,
-                    },
-                    batched=True,
-                    remove_columns=self.raw_dataset["train"].column_names,
-                    num_proc=8,
-                    load_from_cache_file=False,
-                )
-            }
-        )
+        with self.accelerator.local_main_process_first():
+            tokenized_dataset = DatasetDict(
+                {
+                    "train": load_or_tokenize_dataset(
+                        self.raw_dataset["train"],
+                        self.args["train_file"],
+                        tokenize_fn,
+                        fn_kwargs={
+                            "args": self.args,
+                            "tokenizer": self.agent.tokenizer,
+                        },
+                        cache_key=[
+                            self.agent.tokenizer,
+                            self.args["max_input_length"],
+                        ],
+                        cache_dir=self.args.get("tokenized_cache_dir"),
+                    )
+                }
+            )
         self.accelerator.print("Processed data:", tokenized_dataset)
         for mode, dataset in tokenized_dataset.items():
             self.accelerator.print(
@@ -171,42 +175,9 @@ class BCTrainer(BaseTrainer):
                 max(dataset["input_ids_max_length"]),
             )
 
-        def collate_fn(batch, tokenizer):
-            max_input_length = max([len(item["input_ids"]) for item in batch])
-            max_target_length = max([len(item["labels"]) for item in batch])
-            input_ids = []
-            attention_mask = []
-            labels = []
-
-            for item in batch:
-                input_ids.append(
-                    item["input_ids"]
-                    + [tokenizer.pad_token_id]
-                    * (max_input_length - len(item["input_ids"]))
-                )
-                attention_mask.append(
-                    item["attention_mask"]
-                    + [0] * (max_input_length - len(item["attention_mask"]))
-                )
-                labels.append(
-                    item["labels"] + [-100] * (max_target_length - len(item["labels"]))
-                )
-
-            forward_kwargs = {
-                "input_ids": torch.LongTensor(input_ids),
-                "attention_mask": torch.BoolTensor(attention_mask),
-                "labels": torch.LongTensor(labels),
-            }
-            return {"forward_kwargs": forward_kwargs}
-
         self.train_dataset = tokenized_dataset["train"]
-        self.train_dataloader = DataLoader(
-            tokenized_dataset["train"],
-            shuffle=True,
-            batch_size=self.args["batch_size"],
-            num_workers=self.args["num_workers"],
-            pin_memory=True,
-            collate_fn=partial(collate_fn, tokenizer=self.agent.tokenizer),
+        self.train_dataloader = get_train_dataloader(
+            self.train_dataset, self.args, self.agent.tokenizer, self.agent.model
         )
         self.accelerator.print("Number of train batches:", len(self.train_dataloader))
 
@@ -518,6 +489,16 @@ class BCTrainer(BaseTrainer):
         all_success = []
         if dataloader is None:
             dataloader = self.test_dataloader
+        writer = None
+        if record_to_file:
+            inference_file_path = os.path.join(
+                self.args["model_save_path"], "inference.jsonl"
+            )
+            writer = TrajectoryShardWriter(
+                inference_file_path,
+                self.accelerator.process_index,
+                store_token_ids=self.args.get("store_token_ids", False),
+            )
 
         for _, batch in tqdm(
             enumerate(dataloader),
@@ -550,37 +531,33 @@ class BCTrainer(BaseTrainer):
                 cur_batch_success = torch.FloatTensor(
                     [1 if exp.reward == 1 else 0 for exp in exps.experiences]
                 ).to(self.accelerator.device)
-                cur_batch_data_idx = torch.tensor(data_idxs).to(self.accelerator.device)
-                
+
                 # gather operation
                 all_device_batch_rewards = self.accelerator.gather(cur_batch_rewards)
                 all_device_batch_success = self.accelerator.gather(cur_batch_success)
-                all_device_batch_exp = gather_object(exps.experiences)
-                all_device_data_idx = self.accelerator.gather(cur_batch_data_idx)
                 all_rewards.extend(all_device_batch_rewards.cpu().numpy().tolist())
                 all_success.extend(all_device_batch_success.cpu().numpy().tolist())
-                
-                # write inference results to file
-                if record_to_file and self.accelerator.is_main_process:
-                    # write to file
-                    inference_file_path = os.path.join(
-                        self.args["model_save_path"], "inference.jsonl"
-                    )
-                    with jsonlines.open(inference_file_path, mode="a") as f:
-                        for idx, exp in enumerate(all_device_batch_exp):
-                            cur_idx = all_device_data_idx[idx]
-                            conversation = exp.conversation
-                            cur_reward = exp.reward
-                            cur_success = 1 if exp.reward == 1 else 0
-                            item_id = f"{self.args['task_name']}_{cur_idx}"
-                            f.write(
-                                {
-                                    "conversations": conversation,
-                                    "item_id": item_id,
-                                    "reward": cur_reward,
-                                    "success": cur_success,
-                                }
-                            )
+
+                # write inference results to this rank's shard
+                if writer is not None:
+                    for cur_idx, exp in zip(data_idxs, exps.experiences):
+                        writer.write(
+                            {
+                                "conversations": exp.conversation,
+                                "item_id": f"{self.args['task_name']}_{cur_idx}",
+                                "reward": exp.reward,
+                                "success": 1 if exp.reward == 1 else 0,
+                            },
+                            seq_ids=getattr(exp, "seq_ids", None),
+                        )
+
+        if writer is not None:
+            writer.close()
+            self.accelerator.wait_for_everyone()
+            if self.accelerator.is_main_process:
+                merge_trajectory_shards(
+                    inference_file_path, self.accelerator.num_processes
+                )
 
         # fix for duplicated data
         all_rewards = all_rewards[: len(dataloader.dataset)]
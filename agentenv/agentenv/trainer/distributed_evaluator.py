@@ -9,11 +9,17 @@ import jsonlines
 import numpy as np
 import torch
 from accelerate import Accelerator, InitProcessGroupKwargs
-from accelerate.utils import broadcast, gather_object
+from accelerate.utils import broadcast, broadcast_object_list, gather_object
 from agentenv.controller import Agent
 from agentenv.controller.agent import Agent
 from agentenv.controller.task import BaseTask, GenerationConfig
 from agentenv.controller.utils import BaseTrainer
+from agentenv.trainer.trajectory_writer import (
+    TrajectoryShardWriter,
+    count_shards,
+    merge_trajectory_shards,
+    read_trajectories,
+)
 from agentenv.trainer.utils import set_seed
 from datasets import Dataset, DatasetDict
 from torch.utils.data import DataLoader
@@ -33,6 +39,9 @@ class DistributedEvaluator(BaseTrainer):
         # accelerator
         self.accelerator = None
 
+        # number of work queues used so far, see `generate_with_work_queue`
+        self._work_queue_runs = 0
+
         self.create_accelerator()
         self.set_seed()
         self.setup_tokenizer()
@@ -94,6 +103,8 @@ class DistributedEvaluator(BaseTrainer):
             )
 
     def generate(self, dataloader=None):
+        if dataloader is None and self.args.get("work_queue", False):
+            return self.generate_with_work_queue()
         self.optimizer = AdamW(self.agent.model.parameters())
         self.agent.model, self.optimizer, self.inference_dataloader = (
             self.accelerator.prepare(
@@ -150,7 +161,7 @@ class DistributedEvaluator(BaseTrainer):
                 if self.accelerator.is_main_process:
                     with jsonlines.open(self.args["output_file"], mode="a") as f:
                         for idx, exp in enumerate(all_device_batch_exp):
-                            cur_idx = all_device_data_idx[idx]
+                            cur_idx = int(all_device_data_idx[idx])
                             conversation = exp.conversation
                             cur_reward = exp.reward
                             cur_success = 1 if exp.reward == 1 else 0
@@ -185,3 +196,126 @@ class DistributedEvaluator(BaseTrainer):
         self.accelerator.print(f"Score: {mean_reward:.5f}")
         self.accelerator.print(f"Success: {mean_success:.5f}")
 
+    def generate_with_work_queue(self):
+        """
+        Run inference with ranks pulling the next `eval_batch_size` idxs from a
+        shared counter in the torch.distributed store whenever they are idle,
+        instead of working through equal static shards.
+
+        Each rank flushes its finished episodes to its own shard of
+        `output_file` after every batch. Idxs already present in `output_file`
+        or in shards left by an interrupted run are skipped, so a rerun resumes
+        where the last one stopped.
+
+        Ranks run different numbers of generate calls here, so this mode does
+        not work with models sharded across ranks (ZeRO-3, FSDP).
+        """
+        self.optimizer = AdamW(self.agent.model.parameters())
+        self.agent.model, self.optimizer, self.inference_dataloader = (
+            self.accelerator.prepare(
+                self.agent.model, self.optimizer, self.inference_dataloader
+            )
+        )
+        self.agent.model.eval()
+        output_file = self.args["output_file"]
+        task_name = self.args["task_name"]
+
+        # Everything rank 0 finds already finished is shared with all ranks,
+        # so they agree on the list of pending idxs
+        finished = [None]
+        if self.accelerator.is_main_process:
+            finished[0] = {
+                record["item_id"]: record["reward"]
+                for record in read_trajectories(output_file)
+            }
+        finished = broadcast_object_list(finished)[0]
+        all_idxs = [
+            int(item_id.split("_")[-1])
+            for item_id in self.raw_dataset["inference"]["item_id"]
+        ]
+        pending = [idx for idx in all_idxs if f"{task_name}_{idx}" not in finished]
+        self.accelerator.print(
+            f"{len(finished)} idxs already finished, {len(pending)} pending."
+        )
+
+        store = None
+        if torch.distributed.is_initialized():
+            store = torch.distributed.distributed_c10d._get_default_store()
+        queue_key = f"agentenv_eval_work_queue_{self._work_queue_runs}"
+        self._work_queue_runs += 1
+        local_next = 0
+        batch_size = self.args["eval_batch_size"]
+
+        rewards = {}
+        writer = TrajectoryShardWriter(output_file, self.accelerator.process_index)
+        with tqdm(
+            total=len(pending),
+            disable=not self.accelerator.is_main_process,
+            desc="Inference Gen Loop (this rank)",
+        ) as t:
+            while True:
+                # claim the next batch of pending idxs
+                if store is not None:
+                    start = store.add(queue_key, batch_size) - batch_size
+                else:
+                    start, local_next = local_next, local_next + batch_size
+                if start >= len(pending):
+                    break
+                data_idxs = pending[start : start + batch_size]
+
+                with torch.no_grad():
+                    exps = self.eval(
+                        generation_config=GenerationConfig(
+                            max_length=4096,
+                            do_sample=self.args["do_sample"],
+                            temperature=self.args["temperature"],
+                            eos_token_id=self.agent.tokenizer.eos_token_id,
+                            pad_token_id=(
+                                self.agent.tokenizer.pad_token_id
+                                if self.agent.tokenizer.pad_token_id is not None
+                                else self.agent.tokenizer.unk_token_id
+                            ),
+                        ),
+                        max_rounds=self.args["max_round"],
+                        idxs=data_idxs,
+                    )
+
+                for cur_idx, exp in zip(data_idxs, exps.experiences):
+                    item_id = f"{task_name}_{cur_idx}"
+                    writer.write(
+                        {
+                            "conversations": exp.conversation,
+                            "item_id": item_id,
+                            "reward": exp.reward,
+                            "success": 1 if exp.reward == 1 else 0,
+                        }
+                    )
+                    rewards[item_id] = exp.reward
+                writer.flush()
+                t.update(len(data_idxs))
+        writer.close()
+
+        # only the scalar rewards are gathered; trajectories stay in the shards
+        self.accelerator.wait_for_everyone()
+        all_device_rewards = gather_object([rewards])
+        if self.accelerator.is_main_process:
+            merge_trajectory_shards(
+                output_file, max(self.accelerator.num_processes, count_shards(output_file))
+            )
+            for device_rewards in all_device_rewards:
+                finished.update(device_rewards)
+            all_rewards = list(finished.values())
+            mean_reward = torch.FloatTensor([np.mean(all_rewards)])
+            mean_success = torch.FloatTensor(
+                [np.mean([1 if r == 1 else 0 for r in all_rewards])]
+            )
+        else:
+            mean_reward = torch.FloatTensor([-1.0])
+            mean_success = torch.FloatTensor([-1.0])
+
+        mean_reward = broadcast(mean_reward.to(self.accelerator.device)).cpu().numpy().tolist()[0]
+        mean_success = broadcast(mean_success.to(self.accelerator.device)).cpu().numpy().tolist()[0]
+        self.accelerator.print("\n\n==== Inference Evaluation ====\n")
+        self.accelerator.print(f"Score: {mean_reward:.5f}")
+        self.accelerator.print(f"Success: {mean_success:.5f}")
+        return {"score": mean_reward, "success": mean_success}
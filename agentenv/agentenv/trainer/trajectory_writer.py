@@ -0,0 +1,172 @@
+import glob
+import json
+import os
+import re
+from typing import Any, Iterator, Mapping, Optional, Sequence
+
+import numpy as np
+
+TOKEN_DTYPE = np.int32
+
+
+def shard_path(path: str, rank: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.rank{rank:05d}{ext}"
+
+
+def tokens_path(path: str) -> str:
+    return f"{path}.tokens.bin"
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class TrajectoryShardWriter:
+    """
+    Appends the trajectories of one rank to its own JSON lines shard of `path`,
+    so no rank has to gather whole experiences to rank 0.
+
+    With `store_token_ids`, token ids go to a binary int32 side file instead of
+    the JSON record, which only keeps `seq_ids_offset` and `seq_ids_length`.
+    Call `merge_trajectory_shards` once all ranks are done.
+    """
+
+    def __init__(self, path: str, rank: int, store_token_ids: bool = False) -> None:
+        self.path = shard_path(path, rank)
+        self.store_token_ids = store_token_ids
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if not _ends_with_newline(self.path):
+            # terminate a line truncated by an interrupted run before appending
+            self._file.write("\n")
+        self._tokens_file = None
+        self._num_tokens = 0
+        if store_token_ids:
+            self._tokens_file = open(tokens_path(self.path), "ab")
+            self._num_tokens = self._tokens_file.tell() // np.dtype(TOKEN_DTYPE).itemsize
+            self._tokens_file.truncate(self._num_tokens * np.dtype(TOKEN_DTYPE).itemsize)
+
+    def write(
+        self, record: Mapping[str, Any], seq_ids: Optional[Sequence[int]] = None
+    ) -> None:
+        record = dict(record)
+        if self.store_token_ids and seq_ids is not None:
+            tokens = np.asarray(seq_ids, dtype=TOKEN_DTYPE)
+            tokens.tofile(self._tokens_file)
+            record["seq_ids_offset"] = self._num_tokens
+            record["seq_ids_length"] = len(tokens)
+            self._num_tokens += len(tokens)
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self) -> None:
+        self._file.flush()
+        if self._tokens_file is not None:
+            self._tokens_file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+        if self._tokens_file is not None:
+            self._tokens_file.close()
+
+    def __enter__(self) -> "TrajectoryShardWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def merge_trajectory_shards(path: str, num_shards: int, write_index: bool = True) -> int:
+    """
+    Append the shards of `path` written by `num_shards` ranks to `path`, in
+    rank order, and delete them. Token ids are appended to `path`'s token side
+    file with their offsets rebased. With `write_index`, the `item_id` and byte
+    offset of every merged line are appended to `path + ".index"`.
+
+    Returns the number of merged records.
+    """
+    n_records = 0
+    token_itemsize = np.dtype(TOKEN_DTYPE).itemsize
+    index = open(f"{path}.index", "a", encoding="utf-8") if write_index else None
+    with open(path, "ab") as out:
+        tokens_out = None
+        for rank in range(num_shards):
+            shard = shard_path(path, rank)
+            if not os.path.exists(shard):
+                continue
+            shard_tokens = tokens_path(shard)
+            token_base = 0
+            if os.path.exists(shard_tokens):
+                if tokens_out is None:
+                    tokens_out = open(tokens_path(path), "ab")
+                token_base = tokens_out.tell() // token_itemsize
+                with open(shard_tokens, "rb") as f:
+                    while chunk := f.read(1 << 20):
+                        tokens_out.write(chunk)
+                os.remove(shard_tokens)
+
+            with open(shard, "rb") as f:
+                for line in f:
+                    record = _parse_line(line)
+                    if record is None:
+                        continue
+                    if token_base and "seq_ids_offset" in record:
+                        record["seq_ids_offset"] += token_base
+                        line = (json.dumps(record, ensure_ascii=False) + "\n").encode()
+                    if index is not None:
+                        index.write(
+                            json.dumps({"item_id": record.get("item_id"), "offset": out.tell()})
+                            + "\n"
+                        )
+                    out.write(line)
+                    n_records += 1
+            os.remove(shard)
+        if tokens_out is not None:
+            tokens_out.close()
+    if index is not None:
+        index.close()
+    return n_records
+
+
+def _parse_line(line) -> Optional[dict[str, Any]]:
+    # a run killed mid-write can leave a truncated last line in its shard
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+
+def count_shards(path: str) -> int:
+    """One more than the highest rank that left a shard of `path`, or 0"""
+    root, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(root) + r"\.rank(\d{5})" + re.escape(ext) + "$")
+    ranks = [
+        int(m.group(1))
+        for m in map(pattern.match, glob.glob(f"{glob.escape(root)}.rank*{ext}"))
+        if m is not None
+    ]
+    return max(ranks) + 1 if ranks else 0
+
+
+def read_trajectories(path: str) -> Iterator[dict[str, Any]]:
+    """Records of `path` followed by those of its not yet merged shards"""
+    paths = [path] + [shard_path(path, rank) for rank in range(count_shards(path))]
+    for p in paths:
+        if not os.path.exists(p):
+            continue
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                record = _parse_line(line)
+                if record is not None:
+                    yield record
+
+
+def read_token_ids(path: str, record: Mapping[str, Any]) -> np.ndarray:
+    """Token ids of a merged `record` of `path`, memory-mapped from its side file"""
+    tokens = np.memmap(tokens_path(path), dtype=TOKEN_DTYPE, mode="r")
+    start = record["seq_ids_offset"]
+    return tokens[start : start + record["seq_ids_length"]]
@@ -1,7 +1,17 @@
+import hashlib
+import os
 import random
+import shutil
+from functools import partial
 
 import numpy as np
 import torch
+import transformers
+from datasets import load_from_disk
+from datasets.fingerprint import Hasher
+from packaging import version
+from torch.utils.data import DataLoader
+from transformers.trainer_pt_utils import LengthGroupedSampler
 
 
 def set_seed(seed):
@@ -12,3 +22,154 @@ def set_seed(seed):
         torch.cuda.manual_seed_all(seed)
         torch.backends.cudnn.deterministic = True
         torch.backends.cudnn.benchmark = False
+
+
+# flash attention separates packed trajectories by their position_ids since
+PACKING_MIN_TRANSFORMERS_VERSION = "4.44.0"
+
+DEFAULT_TOKENIZED_CACHE_DIR = os.path.expanduser("~/.cache/agentenv/tokenized")
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_or_tokenize_dataset(
+    dataset, data_file, tokenize_fn, fn_kwargs, cache_key, cache_dir=None, num_proc=8
+):
+    """
+    Tokenize `dataset` with `tokenize_fn`, or memory-map the result of an earlier run.
+
+    Results are saved as Arrow shards under `cache_dir`, addressed by the
+    content of `data_file`, `tokenize_fn` and `cache_key` (tokenizer, max
+    length, ...). Call it with the local main process first so each node
+    tokenizes at most once and the other ranks load the saved shards.
+    """
+    cache_dir = cache_dir or DEFAULT_TOKENIZED_CACHE_DIR
+    fingerprint = Hasher.hash([file_sha256(data_file), tokenize_fn, cache_key])
+    cache_path = os.path.join(cache_dir, fingerprint)
+    if os.path.isdir(cache_path):
+        return load_from_disk(cache_path)
+
+    tokenized = dataset.map(
+        tokenize_fn,
+        fn_kwargs=fn_kwargs,
+        batched=True,
+        remove_columns=dataset.column_names,
+        num_proc=num_proc,
+        load_from_cache_file=False,
+    )
+    # Save next to the final path and rename, so a concurrent writer on a
+    # shared file system never exposes a partial cache entry
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    tokenized.save_to_disk(tmp_path)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return load_from_disk(cache_path)
+
+
+def pad_collate_fn(batch, tokenizer):
+    """
+    Right-pad every trajectory to the longest one in the batch.
+    """
+    max_input_length = max([len(item["input_ids"]) for item in batch])
+    max_target_length = max([len(item["labels"]) for item in batch])
+    input_ids = []
+    attention_mask = []
+    labels = []
+
+    for item in batch:
+        input_ids.append(
+            item["input_ids"]
+            + [tokenizer.pad_token_id] * (max_input_length - len(item["input_ids"]))
+        )
+        attention_mask.append(
+            item["attention_mask"]
+            + [0] * (max_input_length - len(item["attention_mask"]))
+        )
+        labels.append(
+            item["labels"] + [-100] * (max_target_length - len(item["labels"]))
+        )
+
+    forward_kwargs = {
+        "input_ids": torch.LongTensor(input_ids),
+        "attention_mask": torch.BoolTensor(attention_mask),
+        "labels": torch.LongTensor(labels),
+    }
+    return {"forward_kwargs": forward_kwargs}
+
+
+def packed_collate_fn(batch):
+    """
+    Concatenate the trajectories of a batch into one padding-free row.
+
+    `position_ids` restart at 0 for every trajectory, which is how flash
+    attention 2 in transformers finds the document boundaries, so no token
+    attends across trajectories. The first label of every trajectory is set
+    to -100 so the last token of one trajectory is not trained to predict the
+    next one.
+    """
+    input_ids = []
+    labels = []
+    position_ids = []
+    for item in batch:
+        input_ids.extend(item["input_ids"])
+        labels.extend([-100] + item["labels"][1:])
+        position_ids.extend(range(len(item["input_ids"])))
+
+    forward_kwargs = {
+        "input_ids": torch.LongTensor([input_ids]),
+        "position_ids": torch.LongTensor([position_ids]),
+        "labels": torch.LongTensor([labels]),
+    }
+    return {"forward_kwargs": forward_kwargs}
+
+
+def get_train_dataloader(dataset, args, tokenizer, model):
+    """
+    Build the train dataloader.
+
+    With `args["packing"]`, every batch is packed into one row instead of
+    being padded; this needs a model loaded with
+    `attn_implementation="flash_attention_2"` and transformers>=4.44.0. With `args["group_by_length"]`,
+    batches are drawn from trajectories of similar length.
+    """
+    if args.get("packing", False):
+        if getattr(model.config, "_attn_implementation", None) != "flash_attention_2":
+            raise ValueError(
+                "packing requires a model loaded with attn_implementation='flash_attention_2'"
+            )
+        if version.parse(transformers.__version__) < version.parse(
+            PACKING_MIN_TRANSFORMERS_VERSION
+        ):
+            # older versions let packed trajectories attend to each other
+            raise ValueError(
+                f"packing requires transformers>={PACKING_MIN_TRANSFORMERS_VERSION}, "
+                f"found {transformers.__version__}"
+            )
+        collate_fn = packed_collate_fn
+    else:
+        collate_fn = partial(pad_collate_fn, tokenizer=tokenizer)
+
+    sampler = None
+    if args.get("group_by_length", False):
+        sampler = LengthGroupedSampler(
+            args["batch_size"],
+            lengths=[len(input_ids) for input_ids in dataset["input_ids"]],
+        )
+
+    return DataLoader(
+        dataset,
+        shuffle=sampler is None,
+        sampler=sampler,
+        batch_size=args["batch_size"],
+        num_workers=args["num_workers"],
+        pin_memory=True,
+        collate_fn=collate_fn,
+    )
@@ -62,6 +62,22 @@ class TrainingArguments:
     logging_step_freq: int = field(default=None)
     seed: int = field(default=42)
     max_input_length: int = field(default=700)
+    packing: bool = field(
+        default=False,
+        metadata={"help": "Pack each batch into one row instead of padding (needs flash attention 2 and transformers>=4.44.0)."},
+    )
+    group_by_length: bool = field(
+        default=False,
+        metadata={"help": "Batch trajectories of similar length together."},
+    )
+    tokenized_cache_dir: str = field(
+        default=None,
+        metadata={"help": "Where tokenized train data is cached (default ~/.cache/agentenv/tokenized)."},
+    )
+    store_token_ids: bool = field(
+        default=False,
+        metadata={"help": "Save inference token ids to a binary side file next to the trajectories."},
+    )
 
     # environment
     max_round: int = field(
@@ -86,7 +102,10 @@ def main():
 
     tokenizer = AutoTokenizer.from_pretrained(args.model_train_path)
     model = AutoModelForCausalLM.from_pretrained(
-        args.model_train_path, low_cpu_mem_usage=True, torch_dtype=torch.bfloat16
+        args.model_train_path,
+        low_cpu_mem_usage=True,
+        torch_dtype=torch.bfloat16,
+        attn_implementation="flash_attention_2" if args.packing else None,
     )
     model.gradient_checkpointing_enable()
 
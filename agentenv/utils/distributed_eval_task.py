@@ -38,6 +38,10 @@ class EvalArguments:
     seed: int = field(default=42)
     do_sample: bool = field(default=False, metadata={"help": "Do sampling or not."})
     temperature: float = field(default=1.0, metadata={"help": "Sampling temperature."})
+    work_queue: bool = field(
+        default=False,
+        metadata={"help": "Let idle ranks pull the next idxs from a shared queue and resume from output_file."},
+    )
 
     # conversation rounds
     max_round: int = field(